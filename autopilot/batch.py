@@ -0,0 +1,135 @@
+"""
+Офлайн-обработка записей и видео: кадры делятся на куски, которые обрабатываются в пуле процессов.
+
+    python -m autopilot.batch session.aprec -o session.npy --workers 8
+
+Каждый процесс перед своим куском прогоняет overlap предыдущих кадров, что бы скользящие окна усреднения линий пришли
+в то же состояние, что и при последовательной обработке. Окно хранит только последние SLIDING_LINE_WINDOW линий,
+поэтому совпадение с последовательным прогоном точное, если в пределах overlap каждая линия была найдена хотя бы
+SLIDING_LINE_WINDOW раз; иначе первые кадры куска могут отличаться.
+
+Режимы Seeker с другим состоянием так не воспроизводятся: состояние трекеров (tracking) сходится к
+последовательному только приближенно, а решение о пропуске кадра (skip_threshold) зависит от того, на каком кадре
+линии искались последний раз. Поэтому они разрешены, только если источник обрабатывается одним куском. frame_budget
+не разрешен вовсе: масштаб подстраивается под измеренное время и от запуска к запуску разный.
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+from autopilot.frames import count_frames, read_frames
+from autopilot.seeker import Seeker, Point, SLIDING_LINE_WINDOW
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_OVERLAP = SLIDING_LINE_WINDOW * 6
+
+NO_LINE = (-1, -1, -1, -1)
+# параметры Seeker, с которыми результат зависит от разбиения на куски (см. описание модуля)
+CHUNK_DEPENDENT_KWARGS = ('tracking', 'skip_threshold')
+
+# результат по кадру: отклонение (NaN, если не найдено), координаты линий (-1, если линия не найдена)
+RESULT_DTYPE = np.dtype([
+    ('frame', '<i8'),
+    ('delta', '<f4'),
+    ('left', '<i4', (4,)),
+    ('right', '<i4', (4,)),
+    ('segments', '<i4'),
+])
+
+
+def _line_coords(line):
+    return NO_LINE if line is None else (line.x1, line.y1, line.x2, line.y2)
+
+
+def process_chunk(path: str, cropbox: List[Point], start: int, stop: int, overlap: int = DEFAULT_OVERLAP,
+                  seeker_kwargs: Optional[dict] = None) -> np.ndarray:
+    """
+    Обрабатывает кадры [start, stop) источника path. Выполняется в отдельном процессе
+    :param path: запись, видео или папка с картинками
+    :param cropbox: кропбокс для Seeker
+    :param start: номер первого кадра куска
+    :param stop: номер кадра, перед которым кусок заканчивается
+    :param overlap: сколько кадров перед куском прогнать для разогрева состояния Seeker
+    :param seeker_kwargs: остальные параметры Seeker
+    :return: массив RESULT_DTYPE
+    """
+    seeker = Seeker(cropbox, **(seeker_kwargs or {}))
+    warmup_start = max(start - overlap, 0)
+    result = np.empty(stop - start, dtype=RESULT_DTYPE)
+    count = 0
+    for index, frame in enumerate(read_frames(path, warmup_start, stop), warmup_start):
+        detection = seeker.detect(frame)
+        if index < start:
+            continue
+        result[count] = (
+            index, np.nan if detection.delta is None else detection.delta, _line_coords(detection.left_line),
+            _line_coords(detection.right_line), detection.segments
+        )
+        count += 1
+    seeker.close()
+    return result[:count]
+
+
+def process_offline(path: str, cropbox: List[Point], workers: Optional[int] = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP, **seeker_kwargs) -> np.ndarray:
+    """
+    Обрабатывает весь источник, раскидывая куски по пулу процессов
+    :param path: запись, видео или папка с картинками
+    :param cropbox: кропбокс для Seeker
+    :param workers: количество процессов (None - по числу ядер, 1 - в текущем процессе)
+    :param chunk_size: кадров в одном куске
+    :param overlap: кадров разогрева перед каждым куском
+    :param seeker_kwargs: остальные параметры Seeker
+    :return: массив RESULT_DTYPE по всем кадрам
+    :raises ValueError: если заданы режимы Seeker, результат которых зависит от разбиения на куски или от времени
+    """
+    if seeker_kwargs.get('frame_budget') is not None:
+        raise ValueError("frame_budget depends on measured latency and is not reproducible offline")
+    total = count_frames(path)
+    bounds = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+    chunked = [key for key in CHUNK_DEPENDENT_KWARGS if seeker_kwargs.get(key)]
+    if chunked and len(bounds) > 1:
+        raise ValueError("{} state is not reproduced across chunks; use chunk_size >= {} to process the source "
+                         "in one piece".format(', '.join(chunked), total))
+    if workers == 1:
+        parts = [process_chunk(path, cropbox, start, stop, overlap, seeker_kwargs) for start, stop in bounds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(process_chunk, path, cropbox, start, stop, overlap, seeker_kwargs) for start, stop in bounds
+            ]
+            parts = [f.result() for f in futures]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=RESULT_DTYPE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline lane detection over recordings, videos or image folders")
+    parser.add_argument('path', help="directory with images, a recording or a video file")
+    parser.add_argument('-o', '--output', required=True, help="where to save the per-frame results (.npy)")
+    parser.add_argument('--cropbox', type=lambda v: tuple(int(x) for x in v.split(',')),
+                        help="x1,y1,x2,y2; whole frame by default")
+    parser.add_argument('--roi', type=lambda v: tuple(float(x) for x in v.split(',')),
+                        help="8 ROI coefficients as in Seeker")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--overlap', type=int, default=DEFAULT_OVERLAP)
+    args = parser.parse_args()
+
+    if args.cropbox is None:
+        height, width = next(iter(read_frames(args.path, 0, 1))).shape[:2]
+        cropbox = [Point(0, 0), Point(width, height)]
+    else:
+        cropbox = [Point(*args.cropbox[:2]), Point(*args.cropbox[2:])]
+    seeker_kwargs = {'roi': args.roi} if args.roi else {}
+
+    result = process_offline(args.path, cropbox, args.workers, args.chunk_size, args.overlap, **seeker_kwargs)
+    np.save(args.output, result)
+    detected = np.count_nonzero(~np.isnan(result['delta']))
+    print("{} frames, delta found on {}".format(result.shape[0], detected))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Замер задержек каждой стадии Seeker на записанных кадрах.
+
+    python -m autopilot.benchmark frames/ --hough 2,15,40,25 --hough 1,20,60,20 --roi 0.22,0.8,0.4,0.55,0.6,0.55,0.78,0.8
+"""
+import argparse
+import itertools
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from autopilot.frames import read_frames
+from autopilot.metrics import PERCENTILES
+from autopilot.seeker import Seeker, Point
+from autopilot.timing import StageTimer
+
+STAGES = ('fingerprint', 'crop', 'cvtColor', 'resize', 'GaussianBlur', 'Canny', 'tracked_edges', 'mask', 'HoughLinesP',
+          'parallel_halves', 'classification', 'averaging', 'overlay')
+
+DEFAULT_ROI = (0.2, 0.95, 0.45, 0.6, 0.55, 0.6, 0.8, 0.95)
+DEFAULT_HOUGH = (2, 15, 40, 25)  # rho, threshold, min_line_length, max_line_gap
+
+
+def load_frames(path: str, limit: Optional[int] = None) -> List[np.ndarray]:
+    """
+    Загружает кадры в память целиком, что бы декодирование не попадало в замеры
+    :param path: папка или файл
+    :param limit: максимальное количество кадров
+    :return:
+    """
+    frames = list(read_frames(path, 0, limit))
+    if not frames:
+        raise ValueError("No frames found in {}".format(path))
+    return frames
+
+
+class BenchmarkConfig:
+    """
+    Один вариант настроек Seeker для сравнения
+    """
+    def __init__(self, hough: Tuple[int, int, int, int] = DEFAULT_HOUGH, roi: Tuple[float, ...] = DEFAULT_ROI,
+                 show_data: bool = False, roi_index: int = 0, tracking: bool = False, parallel: bool = False,
+                 skip_threshold: Optional[float] = None):
+        """
+
+        :param hough: rho, threshold, min_line_length, max_line_gap
+        :param roi: зона интереса, как в Seeker
+        :param show_data: рисовать ли данные поверх кадра
+        :param roi_index: номер зоны интереса в списке, только для названия
+        :param tracking: включить трекинг линий между кадрами
+        :param parallel: искать левую и правую линии в двух потоках
+        :param skip_threshold: порог пропуска почти одинаковых кадров, как в Seeker
+        """
+        self.hough = hough
+        self.roi = roi
+        self.show_data = show_data
+        self.roi_index = roi_index
+        self.tracking = tracking
+        self.parallel = parallel
+        self.skip_threshold = skip_threshold
+
+    @property
+    def name(self):
+        return "rho={} thr={} len={} gap={} roi=#{} {}{}{}{}".format(
+            *self.hough, self.roi_index, 'show_data' if self.show_data else 'headless',
+            ' tracking' if self.tracking else '', ' parallel' if self.parallel else '',
+            ' skip<{}'.format(self.skip_threshold) if self.skip_threshold is not None else ''
+        )
+
+    def create_seeker(self, cropbox: List[Point]) -> Seeker:
+        rho, threshold, min_line_length, max_line_gap = self.hough
+        return Seeker(cropbox, roi=self.roi, rho=rho, threshold=threshold, min_line_length=min_line_length,
+                      max_line_gap=max_line_gap, tracking=self.tracking, parallel=self.parallel,
+                      skip_threshold=self.skip_threshold)
+
+
+def _process(seeker: Seeker, frame, show_data: bool):
+    detection = seeker.detect(frame)
+    if show_data:
+        seeker.draw(frame, detection)
+    return detection
+
+
+def run_config(frames: List[np.ndarray], cropbox: List[Point], config: BenchmarkConfig, repeat: int = 1,
+               warmup: int = 5) -> Dict:
+    """
+    Прогоняет кадры через Seeker с настройками config
+    :param frames: кадры
+    :param cropbox: кропбокс для Seeker
+    :param config: настройки
+    :param repeat: сколько раз прогнать весь набор кадров
+    :param warmup: сколько кадров прогнать до начала замеров (ленивая инициализация OpenCV, кэши)
+    :return: словарь с замерами: stages (секунды по стадиям), total (секунды на кадр), peak (на сколько байт пик
+        памяти, отслеживаемой tracemalloc, во время кадра выше ее объема перед кадром), frames, both_rate (доля кадров
+        с обеими линиями)
+    """
+    seeker = config.create_seeker(cropbox)
+    for frame in frames[:warmup]:
+        _process(seeker, frame, config.show_data)
+
+    timer = StageTimer()
+    seeker.timer = timer
+    total = []
+    both = 0
+    for _ in range(repeat):
+        for frame in frames:
+            started = time.perf_counter()
+            detection = _process(seeker, frame, config.show_data)
+            total.append(time.perf_counter() - started)
+            both += detection.left_line is not None and detection.right_line is not None
+    seeker.timer = StageTimer()  # отдельный проход для памяти: tracemalloc сильно замедляет работу
+
+    peak = []
+    tracemalloc.start()
+    try:
+        for frame in frames:
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            _process(seeker, frame, config.show_data)
+            peak.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+        seeker.close()
+
+    return {
+        'stages': timer.stages,
+        'total': total,
+        'peak': peak,
+        'frames': len(total),
+        'both_rate': both / len(total),
+    }
+
+
+def format_result(name: str, result: Dict) -> str:
+    """
+    Текстовый отчет по одному варианту настроек
+    :param name:
+    :param result: результат run_config()
+    :return:
+    """
+    lines = [name]
+    header = "  {:<16}" + "{:>10}" * len(PERCENTILES)
+    row = "  {:<16}" + "{:>10.3f}" * len(PERCENTILES)
+    lines.append(header.format('stage, ms', *['p{}'.format(p) for p in PERCENTILES]))
+    stages = [s for s in STAGES if s in result['stages']]
+    for stage, samples in [(s, result['stages'][s]) for s in stages] + [('total', result['total'])]:
+        lines.append(row.format(stage, *np.percentile(np.array(samples) * 1000, PERCENTILES)))
+    lines.append("  fps: {:.1f}  peak bytes/frame: {:.1f} KiB  both lanes: {:.0%}  frames: {}".format(
+        result['frames'] / sum(result['total']), np.mean(result['peak']) / 1024, result['both_rate'],
+        result['frames']
+    ))
+    return "\n".join(lines)
+
+
+def _parse_numbers(value: str, cast, count: int):
+    numbers = tuple(cast(v) for v in value.split(','))
+    if len(numbers) != count:
+        raise argparse.ArgumentTypeError("Expected {} comma separated values, got {}".format(count, value))
+    return numbers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage Seeker latency benchmark over recorded frames")
+    parser.add_argument('path', help="directory with images, a recording or a video file")
+    parser.add_argument('--cropbox', type=lambda v: _parse_numbers(v, int, 4),
+                        help="x1,y1,x2,y2; whole frame by default")
+    parser.add_argument('--hough', type=lambda v: _parse_numbers(v, int, 4), action='append',
+                        help="rho,threshold,min_line_length,max_line_gap; repeat to compare")
+    parser.add_argument('--roi', type=lambda v: _parse_numbers(v, float, 8), action='append',
+                        help="8 ROI coefficients as in Seeker; repeat to compare")
+    parser.add_argument('--show-data', action='store_true', help="also measure with visualization enabled")
+    parser.add_argument('--tracking', action='store_true', help="also measure with lane tracking enabled")
+    parser.add_argument('--parallel', action='store_true', help="also measure with left/right halves in parallel")
+    parser.add_argument('--skip', type=float, metavar='THRESHOLD',
+                        help="also measure with skipping of nearly identical frames at this threshold")
+    parser.add_argument('--limit', type=int, help="maximum number of frames to load")
+    parser.add_argument('--repeat', type=int, default=1, help="passes over the frame set")
+    args = parser.parse_args()
+
+    frames = load_frames(args.path, args.limit)
+    if args.cropbox is None:
+        height, width = frames[0].shape[:2]
+        cropbox = [Point(0, 0), Point(width, height)]
+    else:
+        cropbox = [Point(*args.cropbox[:2]), Point(*args.cropbox[2:])]
+
+    modes = (False, True) if args.show_data else (False,)
+    tracking_modes = (False, True) if args.tracking else (False,)
+    parallel_modes = (False, True) if args.parallel else (False,)
+    skip_modes = (None, args.skip) if args.skip is not None else (None,)
+    rois = list(enumerate(args.roi or [DEFAULT_ROI]))
+    for hough, (roi_index, roi), show_data, tracking, parallel, skip_threshold in itertools.product(
+            args.hough or [DEFAULT_HOUGH], rois, modes, tracking_modes, parallel_modes, skip_modes):
+        config = BenchmarkConfig(hough, roi, show_data, roi_index, tracking, parallel, skip_threshold)
+        print(format_result(config.name, run_config(frames, cropbox, config, args.repeat)))
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Настройки, подобранные для конкретной машины и игры (кропбокс, зона интереса, параметры Seeker и установившийся
+масштаб адаптивного режима), сохраняются в JSON, что бы после перезапуска сразу работать с ними, а не подбирать заново.
+"""
+import json
+import os
+from typing import Dict, List, Optional
+
+from autopilot.seeker import Point
+
+CALIBRATION_PATH = 'calibration.json'
+
+
+class Calibration:
+    """
+    Сохраняемые между запусками настройки
+    """
+    def __init__(self, cropbox: List[Point], seeker: Optional[Dict] = None, scale: float = 1.):
+        """
+
+        :param cropbox: область экрана для захвата
+        :param seeker: параметры Seeker, включая roi (например, элемент фронта из autopilot.tuning)
+        :param scale: последний масштаб адаптивного режима Seeker
+        """
+        self.cropbox = cropbox
+        self.seeker = dict(seeker or {})
+        self.scale = scale
+
+    def to_dict(self) -> Dict:
+        return {
+            'cropbox': [self.cropbox[0].x, self.cropbox[0].y, self.cropbox[1].x, self.cropbox[1].y],
+            'seeker': self.seeker,
+            'scale': self.scale,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Calibration':
+        x1, y1, x2, y2 = data['cropbox']
+        return cls([Point(x1, y1), Point(x2, y2)], data.get('seeker'), data.get('scale', 1.))
+
+    @classmethod
+    def load(cls, path: str = CALIBRATION_PATH) -> Optional['Calibration']:
+        """
+        Читает сохраненные настройки
+        :param path:
+        :return: настройки или None, если файла нет или он поврежден
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                return cls.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            print("Ignoring broken calibration {}: {}".format(path, e))
+            return None
+
+    def save(self, path: str = CALIBRATION_PATH):
+        """
+        Сохраняет настройки. Файл подменяется целиком, что бы падение во время записи не оставило его поврежденным
+        :param path:
+        :return:
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
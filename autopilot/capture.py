@@ -0,0 +1,151 @@
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import mss
+import numpy as np
+
+from autopilot.seeker import Point
+
+CAPTURE_BUFFERS = 3  # минимум для тройной буферизации: последний кадр, читаемый кадр, записываемый кадр
+
+
+class ScreenGrabber:
+    """
+    Захват экрана в отдельном потоке. Держит одну сессию mss на все время работы, снимает только область кропбокса
+    и складывает кадры в кольцо заранее выделенных буферов. Потребитель всегда получает самый свежий кадр
+    """
+    def __init__(self, cropbox: List[Point], monitor: int = 2, buffers: int = CAPTURE_BUFFERS):
+        """
+
+        :param cropbox: область экрана (координаты относительно монитора), которую нужно снимать
+        :param monitor: номер монитора в терминах mss (0 - все мониторы сразу)
+        :param buffers: количество буферов в кольце, не меньше трех
+        """
+        self._active = False
+        if buffers < CAPTURE_BUFFERS:
+            raise ValueError("At least {} buffers are required".format(CAPTURE_BUFFERS))
+
+        self.cropbox = cropbox
+        self.monitor = monitor
+        self.size: Point = cropbox[1] - cropbox[0]
+
+        # mss отдает кадры в формате BGRA
+        self._buffers = [np.empty((self.size.y, self.size.x, 4), dtype=np.uint8) for _ in range(buffers)]
+        self._timestamps = [0.] * buffers
+        self._grab_started = [0.] * buffers  # время начала снимка, для трассировки задержек
+
+        self._latest = -1  # индекс буфера с последним готовым кадром
+        self._reading = -1  # индекс буфера, который сейчас отдан потребителю
+        self._frame_id = 0  # порядковый номер последнего готового кадра
+        self.error: Optional[Exception] = None  # исключение, на котором остановился захват
+
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __del__(self):
+        self.stop()
+
+    def _region(self, sct) -> dict:
+        """
+        Переводит кропбокс в абсолютные координаты экрана
+        :param sct: сессия mss
+        :return:
+        """
+        mon = sct.monitors[self.monitor]
+        return {
+            'left': mon['left'] + self.cropbox[0].x,
+            'top': mon['top'] + self.cropbox[0].y,
+            'width': self.size.x,
+            'height': self.size.y,
+        }
+
+    def _next_slot(self) -> int:
+        """
+        Выбирает буфер для записи: не последний готовый кадр и не тот, что сейчас читается
+        :return:
+        """
+        for i in range(len(self._buffers)):
+            if i != self._latest and i != self._reading:
+                return i
+
+    def _capture_cycle(self):
+        """
+        В цикле снимаем экран и публикуем кадры. Сессия mss создается внутри потока, т.к. на X11 она привязана к нему
+        :return:
+        """
+        try:
+            with mss.mss() as sct:
+                region = self._region(sct)
+                while self._active:
+                    with self._cond:
+                        slot = self._next_slot()
+                    grab_started = time.monotonic()
+                    shot = sct.grab(region)
+                    timestamp = time.monotonic()
+                    frame = np.frombuffer(shot.raw, dtype=np.uint8).reshape(self.size.y, self.size.x, 4)
+                    np.copyto(self._buffers[slot], frame)
+                    with self._cond:
+                        self._timestamps[slot] = timestamp
+                        self._grab_started[slot] = grab_started
+                        self._latest = slot
+                        self._frame_id += 1
+                        self._cond.notify_all()
+        except Exception as e:  # нет дисплея, неверный монитор, смена разрешения...
+            # без этого поток умер бы молча, а read() до бесконечности возвращал бы None
+            with self._cond:
+                self.error = e
+                self._active = False
+                self._cond.notify_all()
+
+    def read(self, last_id: int = 0, timeout: Optional[float] = None) -> Optional[Tuple[int, float, np.ndarray]]:
+        """
+        Возвращает самый свежий кадр, более новый, чем last_id. Буфер кадра остается действительным до следующего
+        вызова read(), копировать его не нужно
+        :param last_id: номер последнего обработанного кадра
+        :param timeout: сколько ждать нового кадра (None - без ограничения)
+        :return: (номер кадра, время захвата по time.monotonic(), кадр) или None, если кадр не дождались
+        :raises RuntimeError: если захват остановился из-за ошибки (исходная ошибка - в __cause__)
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._frame_id > last_id or not self._active, timeout):
+                return None
+            if self.error is not None:
+                raise RuntimeError("Screen capture failed: {}".format(self.error)) from self.error
+            if self._frame_id <= last_id:
+                return None
+            self._reading = self._latest
+            return self._frame_id, self._timestamps[self._reading], self._buffers[self._reading]
+
+    @property
+    def grab_started(self) -> float:
+        """
+        Время начала снимка (по time.monotonic()) кадра, последним отданного read()
+        :return:
+        """
+        return self._grab_started[self._reading]
+
+    def start(self):
+        """
+        Запускаем захват в отдельном потоке
+        :return:
+        """
+        if self._active:
+            return
+        self.error = None
+        self._active = True
+        self._thread = threading.Thread(target=self._capture_cycle, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Останавливаем захват и будим всех, кто ждет кадр
+        :return:
+        """
+        if not self._active:
+            return
+        with self._cond:
+            self._active = False
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
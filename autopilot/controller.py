@@ -2,6 +2,22 @@ import socket
 import struct
 import time
 import threading
+from typing import Optional
+
+from autopilot.metrics import NULL_METRICS
+from autopilot.telemetry import OUTGAUGE_PACKET, TELEMETRY_HISTORY, Telemetry, TelemetryHistory
+from autopilot.tracing import NULL_TRACER
+
+RECV_BUFFER_SIZE = 256
+RECV_PORT = 4445  # порт, на который игра шлет телеметрию
+SEND_PORT = 4444  # порт игры для пакетов управления и сопряжения
+PAIR_ADDRESS = '255.255.255.255'  # куда рассылается запрос на сопряжение
+PAIR_TIMEOUT = 0.1  # сколько ждать ответа на первый запрос сопряжения, с
+PAIR_MAX_TIMEOUT = 2.  # до скольких секунд растет ожидание при повторных запросах в фоновом режиме
+SEND_INTERVAL = 0.06  # период отправки данных в игру в режиме опроса, с
+COALESCE_INTERVAL = 0.005  # минимальный интервал между пакетами в событийном режиме, с
+
+CONTROL_PACKET = struct.Struct('>4f')  # руль, газ, тормоз, время отправки в мс от time_origin (от начала эпохи)
 
 
 class Controller:
@@ -9,20 +25,61 @@ class Controller:
     Интерфейс для управления автомобилем и считывания основных его характеристик
     (скорость, обороты, положение рулевых колес)
     """
-    def __init__(self, client_name: str, security_code: int, local_host='192.168.1.5', remote_host='192.168.1.8'):
+    def __init__(self, client_name: str, security_code: int, local_host='192.168.1.5', remote_host='192.168.1.8',
+                 event_driven: bool = False, keepalive_interval: float = SEND_INTERVAL,
+                 coalesce_interval: float = COALESCE_INTERVAL, history_size: int = TELEMETRY_HISTORY,
+                 metrics=NULL_METRICS, recv_port: int = RECV_PORT, send_port: int = SEND_PORT,
+                 pair_address: str = PAIR_ADDRESS, time_origin: float = 0.,
+                 background_pairing: bool = False, tracer=NULL_TRACER):
         """
 
         :param client_name: Название клиентской программы
         :param security_code: Код безопасности (может быть извлечен из QR-кода в игре
         :param local_host: адрес компьютера клиента
         :param remote_host: адрес компьютера с запущенной на нем игрой
+        :param event_driven: отправлять данные сразу при изменении руля, газа или тормоза, а не раз в SEND_INTERVAL
+        :param keepalive_interval: в событийном режиме - через сколько секунд без изменений повторить последний пакет
+        :param coalesce_interval: в событийном режиме - минимальный интервал между пакетами, все изменения за это
+            время уходят одним пакетом
+        :param history_size: сколько последних пакетов телеметрии хранить в истории
+        :param metrics: autopilot.metrics.MetricsRegistry для интервалов отправки, джиттера и частоты получения пакетов
+        :param recv_port: локальный порт для телеметрии; у каждого экземпляра игры на одной машине свой
+        :param send_port: порт игры для управления
+        :param pair_address: адрес для запроса на сопряжение; широковещательный по умолчанию, для игры (или
+            autopilot.simulator) на этой же машине - 127.0.0.1
+        :param time_origin: момент по time.time(), от которого отсчитывается время отправки в пакетах управления. По
+            умолчанию 0 - миллисекунды от начала эпохи, как их шлет оригинальный клиент игры. Время передается во
+            float32, и миллисекунды от начала эпохи в нем огрублены до двух минут; для замера задержки на
+            autopilot.simulator можно задать общий с ним момент (например, время запуска), от него время точное
+            несколько часов. С настоящей игрой это не проверено
+        :param background_pairing: не ждать сопряжения в конструкторе, а повторять запросы в фоне, каждый раз вдвое
+            дольше ожидая ответ (до PAIR_MAX_TIMEOUT), пока игра не ответит. Готовность - событие paired; до него
+            пакеты управления не отправляются
+        :param tracer: autopilot.tracing.Tracer; каждый отправленный пакет отмечается в записи кадра steering_frame
         """
-        self.throttle = 0.0  # степень нажатия педали газа
-        self.steering = 0.5  # положение рулевого колеса (0 - влево, 0.5 - центр, 1 - вправо)
-        self.brakes = 0.0  # степень нажатия педали тормоза
+        self.event_driven = event_driven
+        self.keepalive_interval = keepalive_interval
+        self.coalesce_interval = coalesce_interval
+        self._send_cond = threading.Condition()
+        self._changed = False  # менялось ли управление с момента отправки последнего пакета
+        self._last_send = 0.
+        self._last_send_interval = 0.
 
-        self.rpm = 0  # об./мин
-        self.speed = 0.  # км/ч
+        self._sent_metric = metrics.counter('controller.sent')
+        self._send_errors_metric = metrics.counter('controller.send_errors')
+        self._send_interval_metric = metrics.histogram('controller.send_interval')
+        self._send_jitter_metric = metrics.histogram('controller.send_jitter')
+        self._received_metric = metrics.counter('controller.received')
+        self._recv_timeouts_metric = metrics.counter('controller.recv_timeouts')
+        self._bad_packets_metric = metrics.counter('controller.bad_packets')
+
+        self._throttle = 0.0  # степень нажатия педали газа
+        self._steering = 0.5  # положение рулевого колеса (0 - влево, 0.5 - центр, 1 - вправо)
+        self._brakes = 0.0  # степень нажатия педали тормоза
+        self.steering_frame = -1  # номер кадра, по которому посчитано текущее положение руля, для трассировки
+        self.tracer = tracer
+
+        self.history = TelemetryHistory(history_size)  # пакеты OutGauge; скорость, обороты и т.д. читаются из нее
 
         self._recv_active = True
         self._send_active = True
@@ -30,32 +87,37 @@ class Controller:
         self._recv_thread = None
         self._send_thread = None
 
+        self.paired = threading.Event()  # игра ответила на запрос сопряжения
+        self._require_pairing = background_pairing
+        self._pair_active = False
+        self._pair_thread = None
+
         self.client_name = client_name
         self.security_code = security_code
         self.local_host = local_host
         self.remote_host = remote_host
 
-        self.recv_port = 4445
-        self.send_port = 4444
+        self.recv_port = recv_port
+        self.send_port = send_port
+        self.pair_address = pair_address
+        self.time_origin = time_origin
 
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         self._socket.settimeout(0.1)
         self._socket.bind((self.local_host, self.recv_port))
 
-        self._do_pair()
+        if background_pairing:
+            self._pair_active = True
+            self._pair_thread = threading.Thread(target=self._pair_cycle, daemon=True)
+            self._pair_thread.start()
+        else:
+            self._do_pair()
 
     def __del__(self):
-        self._recv_active = False
-        self._send_active = False
-        try:
-            self._recv_thread.join()
-            self._send_thread.join()
-        except Exception as e:
-            print(e)
-
+        self.stop()
         self._socket.close()
 
-    def _do_pair(self):
+    def _send_pair_request(self):
         """
         Отреверсенный механизм аутентификации клиента, https://github.com/BeamNG/remotecontrol
         :return:
@@ -65,58 +127,240 @@ class Controller:
         sock.bind((self.local_host, 0))
         sock.sendto(
             ('beamng|' + self.client_name + '|' + str(self.security_code)).encode('utf-8'),
-            ("255.255.255.255", self.send_port)
+            (self.pair_address, self.send_port)
         )
         sock.close()
-        success = False
 
-        while not success:
+    def _check_pair_reply(self, data) -> bool:
+        """
+        Проверяет, является ли пакет ответом игры на запрос сопряжения, и если да - отмечает сопряжение
+        :param data:
+        :return:
+        """
+        if bytes(data) != ('beamng|' + str(self.security_code)).encode('utf-8'):
+            return False
+        if not self.paired.is_set():
+            print("Paired successfully")
+            self.paired.set()
+        return True
+
+    def _wait_pair_reply(self, timeout: float) -> bool:
+        """
+        Ждет ответа игры на запрос сопряжения. Если цикл получения уже запущен, ответ может достаться ему - тогда
+        он сам отметит сопряжение
+        :param timeout:
+        :return: состоялось ли сопряжение
+        """
+        deadline = time.monotonic() + timeout
+        # фоновое сопряжение прерывается по stop(), не дожидаясь конца окна ожидания
+        while not self.paired.is_set() and (self._pair_active or self._pair_thread is None):
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return False
+            self._socket.settimeout(min(left, 0.1))
             try:
-                data = self._socket.recv(256)
-                if data.decode("utf-8") == 'beamng|' + str(self.security_code):
-                    print("Paired successfully")
-                    success = True
+                self._check_pair_reply(self._socket.recv(RECV_BUFFER_SIZE))
             except socket.timeout:
-                print("Timeout error. Maybe wrong security code?")
-                break
+                pass
+        return self.paired.is_set()
+
+    def _do_pair(self):
+        """
+        Одна попытка сопряжения, в вызывающем потоке
+        :return:
+        """
+        self._send_pair_request()
+        if not self._wait_pair_reply(PAIR_TIMEOUT):
+            print("Timeout error. Maybe wrong security code?")
+        self._socket.settimeout(0.1)
+
+    def _pair_cycle(self):
+        """
+        Фоновое сопряжение: повторяем запрос, пока игра не ответит, с растущим временем ожидания
+        :return:
+        """
+        timeout = PAIR_TIMEOUT
+        while self._pair_active and not self.paired.is_set():
+            self._send_pair_request()
+            if not self._wait_pair_reply(timeout):
+                timeout = min(timeout * 2, PAIR_MAX_TIMEOUT)
+        self._socket.settimeout(0.1)
+
+    def wait_paired(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ждет сопряжения с игрой
+        :param timeout: сколько ждать (None - без ограничения)
+        :return: состоялось ли сопряжение
+        """
+        return self.paired.wait(timeout)
 
     def _recv_cycle(self):
         """
-        В цикле получаем данные от игры, распаковываем структуру с данными и сохраняем нужное
+        В цикле получаем данные от игры и копируем пакеты в историю. Пакеты читаются в один и тот же заранее
+        выделенный буфер и разбираются только при чтении telemetry, speed и rpm
         :return:
         """
+        buffer = bytearray(RECV_BUFFER_SIZE)
+        packet = memoryview(buffer)
         while self._recv_active:
             try:
-                data = self._socket.recv(256)
-                if not data:
-                    continue
-
-                outgauge_pack = struct.unpack('<I3sxH2B7f2I3f15sx15sxi', data)
-                self.speed = int(outgauge_pack[5]) * 3.6
-                self.rpm = int(outgauge_pack[6])
+                size = self._socket.recv_into(buffer)
             except socket.timeout:
+                self._recv_timeouts_metric.inc()
+                continue
+            if size != OUTGAUGE_PACKET.size:
+                # ответ на фоновый запрос сопряжения мог прийти, когда цикл получения уже запущен
+                if self.paired.is_set() or not self._check_pair_reply(packet[:size]):
+                    self._bad_packets_metric.inc()
                 continue
+            self._received_metric.inc()
+            self.history.append(packet, time.monotonic())
 
-    def _send_cycle(self):
+    @property
+    def telemetry(self) -> Optional[Telemetry]:
+        """
+        Последний полностью разобранный пакет OutGauge
+        :return:
+        """
+        return self.history.latest()
+
+    @property
+    def speed(self) -> float:
+        """
+        Скорость, км/ч
+        :return:
+        """
+        return int(self.history.latest_value('speed')) * 3.6
+
+    @property
+    def rpm(self) -> int:
+        """
+        Обороты, об./мин
+        :return:
+        """
+        return int(self.history.latest_value('rpm'))
+
+    @property
+    def throttle(self):
+        return self._throttle
+
+    @throttle.setter
+    def throttle(self, value):
+        if value != self._throttle:
+            self._throttle = value
+            self._notify_changed()
+
+    @property
+    def steering(self):
+        return self._steering
+
+    @steering.setter
+    def steering(self, value):
+        if value != self._steering:
+            self._steering = value
+            self._notify_changed()
+
+    @property
+    def brakes(self):
+        return self._brakes
+
+    @brakes.setter
+    def brakes(self, value):
+        if value != self._brakes:
+            self._brakes = value
+            self._notify_changed()
+
+    def _notify_changed(self):
+        """
+        Будим цикл отправки, если он работает в событийном режиме. Вызывается только при реальном изменении значения
+        :return:
+        """
+        if self.event_driven:
+            with self._send_cond:
+                self._changed = True
+                self._send_cond.notify()
+
+    def _send_packet(self):
         """
         Упаковываем данные о нажатых педалях, положении рулевого колеса и отправляем в игру
         :return:
         """
+        if self._require_pairing and not self.paired.is_set():
+            return  # игра еще не знает этого клиента
+        try:
+            frame_id = self.steering_frame
+            data = CONTROL_PACKET.pack(self.steering, self.throttle, self.brakes,
+                                       round((time.time() - self.time_origin) * 1000))
+            self._socket.sendto(data, (self.remote_host, self.send_port))
+            self.tracer.sent(frame_id)
+            self._sent_metric.inc()
+        except Exception as e:
+            self._send_errors_metric.inc()
+            print(e)
+        now = time.monotonic()
+        if self._last_send:
+            # джиттер - разница между соседними интервалами отправки
+            interval = now - self._last_send
+            self._send_interval_metric.observe(interval)
+            self._send_jitter_metric.observe(abs(interval - self._last_send_interval))
+            self._last_send_interval = interval
+        self._last_send = now
+
+    def _send_cycle(self):
+        """
+        Отправляем данные в игру раз в SEND_INTERVAL
+        :return:
+        """
         while self._send_active:
-            time.sleep(0.06)
-            try:
-                data = struct.pack('>4f', *[self.steering, self.throttle, self.brakes, round(time.time() * 1000)])
-                self._socket.sendto(data, (self.remote_host, self.send_port))
-            except Exception as e:
-                print(e)
-                continue
+            time.sleep(SEND_INTERVAL)
+            self._send_packet()
+
+    def _send_event_cycle(self):
+        """
+        Отправляем данные сразу после их изменения. Изменения, пришедшие чаще coalesce_interval, склеиваются в один
+        пакет; если ничего не менялось, раз в keepalive_interval повторяем последний пакет
+        :return:
+        """
+        while self._send_active:
+            with self._send_cond:
+                self._send_cond.wait_for(lambda: self._changed or not self._send_active, self.keepalive_interval)
+            if not self._send_active:
+                break
+            wait = self._last_send + self.coalesce_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)  # копим изменения, пришедшие вслед за первым
+            with self._send_cond:
+                self._changed = False
+            self._send_packet()
 
     def run(self):
         """
         Запускаем циклы получения и отправки данных в отдельных потоках
         :return:
         """
+        self._recv_active = True
+        self._send_active = True
         self._recv_thread = threading.Thread(target=self._recv_cycle)
-        self._send_thread = threading.Thread(target=self._send_cycle)
+        self._send_thread = threading.Thread(target=self._send_event_cycle if self.event_driven else self._send_cycle)
         self._recv_thread.start()
         self._send_thread.start()
+
+    def stop(self):
+        """
+        Останавливаем фоновое сопряжение и циклы получения и отправки данных
+        :return:
+        """
+        self._pair_active = False
+        if self._pair_thread is not None:
+            self._pair_thread.join()
+            self._pair_thread = None
+        self._recv_active = False
+        self._send_active = False
+        with self._send_cond:
+            self._send_cond.notify_all()
+        if self._recv_thread is not None:  # run() мог так и не вызываться, например, при фоновом сопряжении
+            self._recv_thread.join()
+            self._recv_thread = None
+        if self._send_thread is not None:
+            self._send_thread.join()
+            self._send_thread = None
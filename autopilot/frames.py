@@ -0,0 +1,75 @@
+"""
+Источники записанных кадров: папка с картинками (в порядке имен файлов), запись autopilot.recorder или видеофайл
+"""
+import os
+from typing import Iterable, List, Optional
+
+import cv2
+import numpy as np
+
+from autopilot.recorder import RECORD_EXTENSION, RecordReader
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def list_images(path: str) -> List[str]:
+    """
+    Картинки в папке, отсортированные по имени
+    :param path:
+    :return:
+    """
+    return [
+        os.path.join(path, name) for name in sorted(os.listdir(path))
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    ]
+
+
+def count_frames(path: str) -> int:
+    """
+    Количество кадров в источнике. Для видео берется из метаданных контейнера и может быть неточным
+    :param path: папка или файл
+    :return:
+    """
+    if os.path.isdir(path):
+        return len(list_images(path))
+    if path.endswith(RECORD_EXTENSION):
+        return len(RecordReader(path))
+    capture = cv2.VideoCapture(path)
+    try:
+        return int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        capture.release()
+
+
+def read_frames(path: str, start: int = 0, stop: Optional[int] = None) -> Iterable[np.ndarray]:
+    """
+    Кадры с номерами [start, stop)
+    :param path: папка или файл
+    :param start: номер первого кадра
+    :param stop: номер кадра, перед которым нужно остановиться (None - до конца)
+    :return:
+    """
+    if os.path.isdir(path):
+        for name in list_images(path)[start:stop]:
+            frame = cv2.imread(name, cv2.IMREAD_UNCHANGED)
+            if frame is not None:
+                yield frame
+        return
+
+    if path.endswith(RECORD_EXTENSION):
+        yield from RecordReader(path).frames[start:stop]  # кадры отдаются без копирования
+        return
+
+    capture = cv2.VideoCapture(path)
+    try:
+        if start:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        index = start
+        while stop is None or index < stop:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            index += 1
+            yield frame
+    finally:
+        capture.release()
@@ -0,0 +1,313 @@
+"""
+Легковесные метрики: счетчики, доли и гистограммы с фиксированными корзинами. Метрики доступны из кода через
+MetricsRegistry.snapshot(), периодически пишутся в CSV (CsvMetricsWriter) или отдаются текстом по HTTP на localhost
+(MetricsServer).
+"""
+import bisect
+import csv
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence
+
+PERCENTILES = (50, 95, 99)
+
+# корзины гистограмм задержек, секунды: от 10 мкс до 10 с с шагом примерно 25%
+LATENCY_BUCKETS = tuple(1e-5 * 1.25 ** i for i in range(63))
+# корзины гистограмм количеств (например, сегментов на кадр)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+class Counter:
+    """
+    Монотонно растущий счетчик
+    """
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+    def snapshot(self, name: str) -> Dict[str, float]:
+        return {name: self.value}
+
+
+class Ratio:
+    """
+    Доля событий, в которых что-то произошло (например, доля кадров, на которых найдены обе линии)
+    """
+    def __init__(self):
+        self.hits = 0
+        self.total = 0
+
+    def observe(self, hit: bool):
+        self.hits += hit
+        self.total += 1
+
+    @property
+    def value(self) -> float:
+        return self.hits / self.total if self.total else 0.
+
+    def snapshot(self, name: str) -> Dict[str, float]:
+        return {name: self.value}
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами. Процентили оцениваются по верхней границе корзины
+    """
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+
+        :param buckets: верхние границы корзин по возрастанию; все, что больше последней, попадает в отдельную корзину
+        """
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.
+
+    def percentile(self, q: float) -> float:
+        """
+        Оценка процентиля q (0..100)
+        :param q:
+        :return:
+        """
+        if not self.count:
+            return 0.
+        rank = q / 100 * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self, name: str) -> Dict[str, float]:
+        result = {name + '.count': self.count, name + '.mean': self.mean, name + '.max': self.max}
+        for q in PERCENTILES:
+            result['{}.p{}'.format(name, q)] = self.percentile(q)
+        return result
+
+
+class MetricsRegistry:
+    """
+    Набор именованных метрик. Метрика создается при первом запросе по имени
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def _get(self, name: str, factory):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(name, factory())
+        return metric
+
+    def counter(self, name: str) -> Counter:
+        return self._get(name, Counter)
+
+    def ratio(self, name: str) -> Ratio:
+        return self._get(name, Ratio)
+
+    def histogram(self, name: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(name, lambda: Histogram(buckets))
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        Текущие значения всех метрик одним плоским словарем
+        :return:
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        result = {}
+        for name, metric in metrics:
+            result.update(metric.snapshot(name))
+        return result
+
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return {name: m.value for name, m in self._metrics.items() if isinstance(m, Counter)}
+
+    def format_text(self, rates: Optional[Dict[str, float]] = None) -> str:
+        """
+        Метрики в текстовом виде, по одной на строку
+        :param rates: скорости счетчиков от RateTracker.rates()
+        :return:
+        """
+        values = self.snapshot()
+        values.update(rates or {})
+        lines = ['uptime {:.3f}'.format(time.monotonic() - self.started)]
+        lines.extend('{} {:.6g}'.format(name, value) for name, value in sorted(values.items()))
+        return '\n'.join(lines) + '\n'
+
+
+class RateTracker:
+    """
+    Скорость роста счетчиков (событий в секунду) между соседними вызовами rates(). У каждого потребителя метрик
+    свой RateTracker, что бы они не сбивали интервалы друг другу
+    """
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._previous = registry.counters()
+        self._previous_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def rates(self) -> Dict[str, float]:
+        """
+        :return: словарь <имя счетчика>.rate -> событий в секунду с прошлого вызова
+        """
+        with self._lock:
+            now = time.monotonic()
+            counters = self.registry.counters()
+            elapsed = max(now - self._previous_time, 1e-9)
+            result = {
+                name + '.rate': (value - self._previous.get(name, 0)) / elapsed for name, value in counters.items()
+            }
+            self._previous, self._previous_time = counters, now
+            return result
+
+
+class _NullMetric:
+    """
+    Метрика, которая ничего не считает
+    """
+    value = 0
+
+    def inc(self, n: int = 1):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+class NullRegistry:
+    """
+    Реестр по умолчанию: отдает метрики-пустышки, что бы не проверять наличие метрик в горячих циклах
+    """
+    _metric = _NullMetric()
+
+    def counter(self, name: str):
+        return self._metric
+
+    def ratio(self, name: str):
+        return self._metric
+
+    def histogram(self, name: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        return self._metric
+
+
+NULL_METRICS = NullRegistry()
+
+
+class MetricsTimer:
+    """
+    Таймер стадий (см. autopilot.timing.StageTimer), записывающий время каждой стадии в гистограмму
+    <prefix>.stage.<стадия>
+    """
+    def __init__(self, registry: MetricsRegistry, prefix: str):
+        self._registry = registry
+        self._prefix = prefix + '.stage.'
+        self._histograms = {}
+        self._last = 0.
+
+    def start(self):
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            histogram = self._histograms[stage] = self._registry.histogram(self._prefix + stage)
+        histogram.observe(now - self._last)
+        self._last = now
+
+
+class CsvMetricsWriter:
+    """
+    Раз в interval секунд дописывает строку с метриками в CSV. Для счетчиков дополнительно пишется скорость
+    (<имя>.rate, событий в секунду за последний интервал)
+    """
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float = 1.):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._active = False
+        self._thread = None
+
+    def _write_cycle(self):
+        with open(self.path, 'w', newline='') as f:
+            writer = None
+            tracker = RateTracker(self.registry)
+            while self._active:
+                time.sleep(self.interval)
+                row = {'time': time.time()}
+                row.update(self.registry.snapshot())
+                row.update(tracker.rates())
+                if writer is None:  # набор колонок фиксируется по первой строке
+                    writer = csv.DictWriter(f, fieldnames=list(row), extrasaction='ignore', restval='')
+                    writer.writeheader()
+                writer.writerow(row)
+                f.flush()
+
+    def start(self):
+        if self._active:
+            return
+        self._active = True
+        self._thread = threading.Thread(target=self._write_cycle, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._active = False
+        if self._thread is not None:
+            self._thread.join()
+
+
+class MetricsServer:
+    """
+    Отдает MetricsRegistry.format_text() по HTTP, по умолчанию только на localhost. Скорости счетчиков считаются
+    с предыдущего запроса
+    """
+    def __init__(self, registry: MetricsRegistry, port: int = 9100, host: str = '127.0.0.1'):
+        tracker = RateTracker(registry)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.format_text(tracker.rates()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.registry = registry
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
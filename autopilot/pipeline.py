@@ -0,0 +1,170 @@
+import threading
+from typing import Any, Optional, Union
+
+from autopilot.capture import ScreenGrabber
+from autopilot.controller import Controller
+from autopilot.metrics import NULL_METRICS
+from autopilot.preview import FramePublisher
+from autopilot.recorder import BackgroundRecorder, Recorder
+from autopilot.seeker import Seeker
+from autopilot.steering import STEERING_RATE, SteeringController
+from autopilot.tracing import NULL_TRACER
+
+
+class LatestSlot:
+    """
+    Очередь на один элемент: новый элемент вытесняет старый, если его еще не забрали. Читатель всегда получает самые
+    свежие данные, а медленная стадия конвейера не копит за собой очередь
+    """
+    def __init__(self):
+        self._item = None
+        self._has_item = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self.dropped = 0  # сколько элементов было вытеснено, так и не дойдя до читателя
+
+    def put(self, item: Any):
+        with self._cond:
+            if self._has_item:
+                self.dropped += 1
+            self._item = item
+            self._has_item = True
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """
+        Забирает элемент из очереди
+        :param timeout: сколько ждать элемента (None - без ограничения)
+        :return: элемент или None, если не дождались или очередь закрыта
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._has_item or self._closed, timeout) or not self._has_item:
+                return None
+            item = self._item
+            self._item = None
+            self._has_item = False
+            return item
+
+    def close(self):
+        """
+        Будит всех ожидающих читателей
+        :return:
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class Pipeline:
+    """
+    Конвейер захват -> поиск линий -> управление. Каждая стадия работает в своем потоке: захват и поиск линий связаны
+    очередью на один элемент, так что поиск всегда берет самый свежий кадр, а руль поворачивается с фиксированной
+    частотой по последним найденным положениям полосы (см. SteeringController)
+    """
+    def __init__(self, grabber: ScreenGrabber, seeker: Seeker, controller: Controller, show_data: bool = False,
+                 recorder: Union[Recorder, BackgroundRecorder, None] = None, steering_rate: float = STEERING_RATE,
+                 metrics=NULL_METRICS, preview_window: Optional[FramePublisher] = None, tracer=NULL_TRACER):
+        """
+
+        :param grabber: источник кадров
+        :param seeker: поиск линий разметки
+        :param controller: управление автомобилем
+        :param show_data: готовить ли кадры с нарисованными данными для get_preview()
+        :param recorder: если задан, каждый обработанный кадр записывается вместе с телеметрией и управлением;
+            BackgroundRecorder пишет файл в своем потоке и не задерживает поиск линий
+        :param steering_rate: частота обновления руля, раз в секунду
+        :param metrics: autopilot.metrics.MetricsRegistry для метрик управления рулем
+        :param preview_window: окно просмотра (PreviewWindow) или другой FramePublisher; данные рисуются только на
+            кадрах, которые успеют показать, прямо в общую память
+        :param tracer: autopilot.tracing.Tracer для сквозной задержки кадров от захвата до пакета управления; он же
+            отдается SteeringController и controller
+        """
+        self.grabber = grabber
+        self.seeker = seeker
+        self.controller = controller
+        self.show_data = show_data
+        self.recorder = recorder
+        self.preview_window = preview_window
+        self.tracer = tracer
+
+        controller.tracer = tracer
+        self.steering = SteeringController(controller, steering_rate, metrics=metrics, tracer=tracer)
+
+        self._preview = LatestSlot()  # кадры для показа
+
+        self._active = False
+        self._detect_thread = None
+        self.error: Optional[Exception] = None  # исключение, остановившее поиск линий (например, отказ захвата)
+        self.failed = threading.Event()  # устанавливается вместе с error, что бы владелец мог остановить конвейер
+
+    def _detect_cycle(self):
+        """
+        Стадия поиска линий: берем самый свежий кадр и ищем на нем полосу
+        :return:
+        """
+        frame_id = 0
+        try:
+            while self._active:
+                frame = self.grabber.read(frame_id, timeout=0.1)
+                if frame is None:
+                    continue
+                frame_id, timestamp, image = frame
+                self.tracer.begin(frame_id, self.grabber.grab_started, timestamp)
+                if self.recorder is not None:
+                    self.recorder.record(image, timestamp, self.controller)
+                detection = self.seeker.detect(image)
+                self.tracer.mark(frame_id, 'detected')
+                self.steering.update(detection.delta, timestamp, frame_id)
+                if self.show_data:  # рисуем только если картинку кто-то смотрит
+                    self._preview.put(self.seeker.draw(image, detection))
+                if self.preview_window is not None and self.preview_window.due():
+                    with self.preview_window.writing() as buffer:
+                        self.seeker.draw(image, detection, out=buffer)
+        except Exception as e:
+            # руль замер бы на последнем значении, поэтому сразу возвращаем его в центр и сообщаем владельцу
+            self.error = e
+            self.steering.reset()
+            self.failed.set()
+
+    def get_preview(self, timeout: Optional[float] = None):
+        """
+        Последний кадр с нарисованными данными (только при show_data=True)
+        :param timeout: сколько ждать кадра
+        :return: кадр или None
+        """
+        return self._preview.get(timeout)
+
+    def start(self):
+        """
+        Запускаем захват, управление и стадии конвейера
+        :return:
+        """
+        if self._active:
+            return
+        self._active = True
+        self.error = None
+        self.failed.clear()
+        self._preview = LatestSlot()
+        if self.preview_window is not None:
+            self.preview_window.start()
+        self.grabber.start()
+        self.controller.run()
+        self.steering.start()
+        self._detect_thread = threading.Thread(target=self._detect_cycle, daemon=True)
+        self._detect_thread.start()
+
+    def stop(self):
+        """
+        Останавливаем все стадии и возвращаем руль в центр
+        :return:
+        """
+        if not self._active:
+            return
+        self._active = False
+        self._preview.close()
+        self._detect_thread.join()
+        self.grabber.stop()
+        self.steering.stop()
+        self.controller.stop()
+        if self.preview_window is not None:
+            self.preview_window.stop()
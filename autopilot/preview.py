@@ -0,0 +1,265 @@
+"""
+Показ кадров с нарисованными данными в отдельном процессе. Конвейер пишет последний кадр в общую память
+(SharedFrame), процесс окна забирает его не чаще заданной частоты и показывает. Ни запись, ни чтение друг друга не
+ждут: вместо блокировки используется счетчик версий (seqlock), и читатель просто пропускает кадр, который был
+перезаписан во время копирования.
+"""
+import multiprocessing
+import time
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+PREVIEW_RATE = 15.  # сколько раз в секунду обновляется окно
+PREVIEW_WINDOW_SIZE = (1280, 720)
+QUIT_KEY = 'q'
+HEADER_SIZE = 64  # счетчик версий занимает отдельную кэш-линию перед кадром
+
+
+class SharedFrame:
+    """
+    Один кадр в общей памяти с последовательным счетчиком версий. Нечетная версия означает, что кадр сейчас
+    перезаписывается. Писатель один, читателей может быть сколько угодно
+    """
+    def __init__(self, shape: Tuple[int, ...], name: Optional[str] = None):
+        """
+
+        :param shape: размер кадра (высота, ширина, каналы), uint8
+        :param name: имя существующего блока общей памяти; без него создается новый блок
+        """
+        self.shape = tuple(shape)
+        size = HEADER_SIZE + int(np.prod(self.shape))
+        self._owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size)
+        self._seq = np.ndarray((1,), dtype=np.uint64, buffer=self._shm.buf)
+        self.frame = np.ndarray(self.shape, dtype=np.uint8, buffer=self._shm.buf, offset=HEADER_SIZE)
+        if self._owner:
+            self._seq[0] = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def seq(self) -> int:
+        return int(self._seq[0])
+
+    @contextmanager
+    def writing(self):
+        """
+        Дает буфер кадра для записи на месте, например, как dst для OpenCV
+        :return:
+        """
+        self._seq[0] += 1
+        try:
+            yield self.frame
+        finally:
+            self._seq[0] += 1
+
+    def write(self, frame: np.ndarray):
+        with self.writing() as buffer:
+            np.copyto(buffer, frame)
+
+    def read(self, out: np.ndarray, last_seq: int = 0) -> Optional[int]:
+        """
+        Копирует кадр, если он новее last_seq и не перезаписывался во время копирования
+        :param out: куда копировать кадр
+        :param last_seq: версия последнего прочитанного кадра
+        :return: версия скопированного кадра или None, если нового целого кадра нет
+        """
+        seq = int(self._seq[0])
+        if seq == last_seq or seq % 2:
+            return None
+        np.copyto(out, self.frame)
+        if int(self._seq[0]) != seq:
+            return None
+        return seq
+
+    def close(self):
+        """
+        Отключается от общей памяти; создатель блока еще и удаляет его
+        :return:
+        """
+        if self._shm is None:
+            return
+        self._seq = self.frame = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+
+
+def _preview_main(name: str, shape: Tuple[int, ...], rate: float, window_size: Tuple[int, int], quit_key: str,
+                  title: str, quit_event, stop_event):
+    """
+    Цикл процесса окна: не чаще rate раз в секунду показываем свежий кадр и проверяем клавишу выхода
+    :return:
+    """
+    import cv2  # окно OpenCV создается только в этом процессе
+
+    shared = SharedFrame(shape, name)
+    image = np.empty(shape, dtype=np.uint8)
+    cv2.namedWindow(title, cv2.WINDOW_KEEPRATIO)
+    cv2.resizeWindow(title, *window_size)
+    period = 1. / rate
+    last_seq = 0
+    try:
+        while not stop_event.is_set():
+            started = time.monotonic()
+            seq = shared.read(image, last_seq)
+            if seq is not None:
+                last_seq = seq
+                cv2.imshow(title, image)
+            key = cv2.waitKey(1)
+            # закрытие окна крестиком - тоже выход
+            if key == ord(quit_key) or cv2.getWindowProperty(title, cv2.WND_PROP_VISIBLE) < 1:
+                quit_event.set()
+                break
+            time.sleep(max(0., period - (time.monotonic() - started)))
+    finally:
+        cv2.destroyAllWindows()
+        shared.close()
+
+
+class FrameViewer:
+    """
+    Процесс с окном, показывающим SharedFrame, созданный кем-то другим
+    """
+    def __init__(self, name: str, shape: Tuple[int, ...], rate: float = PREVIEW_RATE,
+                 window_size: Tuple[int, int] = PREVIEW_WINDOW_SIZE, quit_key: str = QUIT_KEY, title: str = 'frame',
+                 quit_event=None):
+        """
+
+        :param name: имя блока общей памяти SharedFrame
+        :param shape: размер кадров (высота, ширина, каналы)
+        :param rate: максимальная частота обновления окна, кадров в секунду
+        :param window_size: начальный размер окна (ширина, высота)
+        :param quit_key: клавиша выхода
+        :param title: заголовок окна
+        :param quit_event: multiprocessing.Event, который устанавливается по клавише выхода; можно отдать один на
+            несколько окон
+        """
+        # spawn, а не fork: процесс окна не должен наследовать потоки и состояние OpenCV родителя
+        self._context = multiprocessing.get_context('spawn')
+        self.quit_requested = quit_event if quit_event is not None else self._context.Event()
+        self._stop = self._context.Event()
+        self._args = (name, tuple(shape), rate, window_size, quit_key, title)
+        self._process = None
+
+    def start(self):
+        if self._process is not None:
+            return
+        self._stop.clear()
+        self._process = self._context.Process(target=_preview_main, daemon=True,
+                                              args=self._args + (self.quit_requested, self._stop))
+        self._process.start()
+
+    def stop(self):
+        if self._process is None:
+            return
+        self._stop.set()
+        self._process.join(timeout=2)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+
+
+class FramePublisher:
+    """
+    Сторона записи: отдает кадры в SharedFrame не чаще заданной частоты. publish() только копирует кадр в общую
+    память и никогда никого не ждет, а due() позволяет не рисовать данные на кадрах, которые все равно не покажут
+    """
+    def __init__(self, shape: Tuple[int, ...], rate: float = PREVIEW_RATE, name: Optional[str] = None):
+        """
+
+        :param shape: размер кадров (высота, ширина, каналы)
+        :param rate: максимальная частота публикации, кадров в секунду
+        :param name: имя уже созданного SharedFrame (например, в другом процессе); без него блок создается в start()
+        """
+        self.shape = tuple(shape)
+        self.rate = rate
+        self._name = name
+        self._period = 1. / rate
+        self._next_publish = 0.
+        self._shared: Optional[SharedFrame] = None
+
+    @property
+    def name(self) -> str:
+        return self._shared.name if self._shared is not None else self._name
+
+    def due(self) -> bool:
+        """
+        Пора ли готовить следующий кадр
+        :return:
+        """
+        return time.monotonic() >= self._next_publish
+
+    def _published(self):
+        now = time.monotonic()
+        self._next_publish = max(self._next_publish + self._period, now)
+
+    @contextmanager
+    def writing(self):
+        """
+        Буфер общей памяти для рисования кадра прямо на месте, без лишнего копирования
+        :return:
+        """
+        with self._shared.writing() as buffer:
+            yield buffer
+        self._published()
+
+    def publish(self, frame: np.ndarray):
+        """
+        Отдает кадр читателям
+        :param frame:
+        :return:
+        """
+        self._shared.write(frame)
+        self._published()
+
+    def start(self):
+        if self._shared is None:
+            self._shared = SharedFrame(self.shape, self._name)
+
+    def stop(self):
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+
+class PreviewWindow(FramePublisher):
+    """
+    Окно просмотра в отдельном процессе вместе с общей памятью для кадров
+    """
+    def __init__(self, shape: Tuple[int, ...], rate: float = PREVIEW_RATE,
+                 window_size: Tuple[int, int] = PREVIEW_WINDOW_SIZE, quit_key: str = QUIT_KEY):
+        """
+
+        :param shape: размер показываемых кадров (высота, ширина, каналы)
+        :param rate: максимальная частота обновления окна, кадров в секунду
+        :param window_size: начальный размер окна (ширина, высота)
+        :param quit_key: клавиша выхода
+        """
+        super().__init__(shape, rate)
+        self.window_size = window_size
+        self.quit_key = quit_key
+        self.quit_requested = multiprocessing.get_context('spawn').Event()  # в окне нажали клавишу выхода
+        self._viewer: Optional[FrameViewer] = None
+
+    def start(self):
+        if self._viewer is not None:
+            return
+        super().start()
+        self.quit_requested.clear()
+        self._viewer = FrameViewer(self.name, self.shape, self.rate, self.window_size, self.quit_key,
+                                   quit_event=self.quit_requested)
+        self._viewer.start()
+
+    def stop(self):
+        if self._viewer is None:
+            return
+        self._viewer.stop()
+        self._viewer = None
+        super().stop()
@@ -0,0 +1,289 @@
+"""
+Запись кадров вместе с телеметрией и управлением в бинарный файл с фиксированным шагом записей и чтение его через
+memory map без копирования и декодирования.
+
+Формат файла: заголовок HEADER_SIZE байт, затем записи одинаковой длины. В начале каждой записи время захвата кадра,
+скорость и обороты из Controller, отправленные в игру руль, газ и тормоз, а с отступом FRAME_OFFSET - сам кадр.
+"""
+import threading
+from typing import Iterator, Tuple
+
+import numpy as np
+
+RECORD_EXTENSION = '.aprec'
+MAGIC = b'APREC'
+VERSION = 1
+
+HEADER_SIZE = 64
+RECORD_ALIGN = 64  # записи и кадры внутри них выровнены по кэш-линии
+FRAME_OFFSET = 64
+GROW_CHUNK = 256  # на сколько записей за раз увеличивается файл
+WRITER_BUFFERS = 3  # кадр, который пишется в файл, ожидающий кадр и кадр, который копируется
+
+HEADER_DTYPE = np.dtype({
+    'names': ['magic', 'version', 'height', 'width', 'channels', 'count'],
+    'formats': ['S8', '<u4', '<u4', '<u4', '<u4', '<u8'],
+    'offsets': [0, 8, 12, 16, 20, 24],
+    'itemsize': HEADER_SIZE,
+})
+
+
+def record_dtype(height: int, width: int, channels: int) -> np.dtype:
+    """
+    Тип одной записи для кадров заданного размера
+    :param height:
+    :param width:
+    :param channels:
+    :return:
+    """
+    frame_size = height * width * channels
+    return np.dtype({
+        'names': ['timestamp', 'speed', 'rpm', 'steering', 'throttle', 'brakes', 'frame'],
+        'formats': ['<f8', '<f4', '<f4', '<f4', '<f4', '<f4', (np.uint8, (height, width, channels))],
+        'offsets': [0, 8, 12, 16, 20, 24, FRAME_OFFSET],
+        'itemsize': FRAME_OFFSET + -(-frame_size // RECORD_ALIGN) * RECORD_ALIGN,
+    })
+
+
+class Recorder:
+    """
+    Дописывает кадры в файл записи. Файл растет кусками по GROW_CHUNK записей, кадр копируется прямо в отображенную
+    в память запись. В память отображается только текущий кусок: заполненные куски просто отпускаются без flush(),
+    грязные страницы ядро сбрасывает на диск само, и append() не ждет ни записи, ни отображения всего файла
+    """
+    def __init__(self, path: str, height: int, width: int, channels: int = 4):
+        """
+
+        :param path: путь к файлу записи (будет перезаписан)
+        :param height: высота кадров
+        :param width: ширина кадров
+        :param channels: количество каналов кадров (ScreenGrabber отдает BGRA)
+        """
+        self.path = path
+        self._dtype = record_dtype(height, width, channels)
+        self._count = 0
+        self._capacity = 0
+        self._chunk_start = 0  # номер первой записи текущего куска
+        self._records = None  # отображение текущего куска
+
+        with open(path, 'wb') as f:
+            f.truncate(HEADER_SIZE)
+        self._header = np.memmap(path, dtype=HEADER_DTYPE, mode='r+', shape=())
+        self._header['magic'] = MAGIC
+        self._header['version'] = VERSION
+        self._header['height'] = height
+        self._header['width'] = width
+        self._header['channels'] = channels
+        self._header['count'] = 0
+        self._grow()
+
+    def __len__(self):
+        return self._count
+
+    def __del__(self):
+        self.close()
+
+    def _grow(self):
+        """
+        Увеличивает файл на GROW_CHUNK записей и отображает в память новый кусок
+        :return:
+        """
+        self._records = None  # без flush(): синхронная запись всего куска остановила бы поиск линий
+        self._chunk_start = self._capacity
+        self._capacity += GROW_CHUNK
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + self._capacity * self._dtype.itemsize)
+        self._records = np.memmap(self.path, dtype=self._dtype, mode='r+',
+                                  offset=HEADER_SIZE + self._chunk_start * self._dtype.itemsize, shape=(GROW_CHUNK,))
+
+    def append(self, frame: np.ndarray, timestamp: float, speed: float = 0., rpm: float = 0., steering: float = 0.5,
+               throttle: float = 0., brakes: float = 0.):
+        """
+        Дописывает кадр и сопутствующие данные
+        :param frame: кадр размера, заданного при создании
+        :param timestamp: время захвата кадра
+        :param speed: скорость, км/ч
+        :param rpm: обороты, об./мин
+        :param steering: отправленное положение руля
+        :param throttle: отправленная степень нажатия газа
+        :param brakes: отправленная степень нажатия тормоза
+        :return:
+        """
+        if self._count == self._capacity:
+            self._grow()
+        record = self._records[self._count - self._chunk_start]
+        record['frame'][...] = frame
+        record['timestamp'] = timestamp
+        record['speed'] = speed
+        record['rpm'] = rpm
+        record['steering'] = steering
+        record['throttle'] = throttle
+        record['brakes'] = brakes
+        self._count += 1
+        self._header['count'] = self._count  # счетчик меняем последним, что бы читатель не увидел недописанную запись
+
+    def record(self, frame: np.ndarray, timestamp: float, controller):
+        """
+        Дописывает кадр вместе с текущими телеметрией и управлением Controller
+        :param frame:
+        :param timestamp: время захвата кадра
+        :param controller: autopilot.controller.Controller
+        :return:
+        """
+        self.append(frame, timestamp, controller.speed, controller.rpm, controller.steering, controller.throttle,
+                    controller.brakes)
+
+    def close(self):
+        """
+        Сбрасывает данные на диск и обрезает файл до реального количества записей
+        :return:
+        """
+        if self._records is None:
+            return
+        self._records.flush()
+        self._header.flush()
+        self._records = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + self._count * self._dtype.itemsize)
+
+
+class BackgroundRecorder:
+    """
+    Запись в отдельном потоке, что бы поиск линий не ждал диск. record() только копирует кадр в заранее выделенный
+    буфер; поток записи берет самый свежий кадр, а кадры, которые он не успел забрать, пропускаются (их количество -
+    в dropped). Интерфейс тот же, что у Recorder: record() и close()
+    """
+    def __init__(self, recorder: Recorder, buffers: int = WRITER_BUFFERS):
+        """
+
+        :param recorder: куда записывать кадры
+        :param buffers: количество буферов кадров, не меньше трех
+        """
+        if buffers < WRITER_BUFFERS:
+            raise ValueError("At least {} buffers are required".format(WRITER_BUFFERS))
+        self.recorder = recorder
+        frame_shape = recorder._dtype['frame'].shape
+        self._frames = [np.empty(frame_shape, dtype=np.uint8) for _ in range(buffers)]
+        self._values = [()] * buffers  # время захвата, телеметрия и управление к каждому буферу
+        self._pending = -1  # индекс буфера, ожидающего записи
+        self._writing = -1  # индекс буфера, который сейчас пишется в файл
+        self.dropped = 0  # сколько кадров вытеснено, так и не попав в файл
+
+        self._cond = threading.Condition()
+        self._active = True
+        self._thread = threading.Thread(target=self._write_cycle, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self.recorder)
+
+    def _write_cycle(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending >= 0 or not self._active)
+                if self._pending < 0:
+                    return  # остановлены и все дописано
+                self._writing, self._pending = self._pending, -1
+                slot = self._writing
+            self.recorder.append(self._frames[slot], *self._values[slot])
+            with self._cond:
+                self._writing = -1
+
+    def record(self, frame: np.ndarray, timestamp: float, controller):
+        """
+        Ставит кадр в очередь на запись вместе с текущими телеметрией и управлением Controller
+        :param frame:
+        :param timestamp: время захвата кадра
+        :param controller: autopilot.controller.Controller
+        :return:
+        """
+        with self._cond:
+            slot = next(i for i in range(len(self._frames)) if i != self._pending and i != self._writing)
+        np.copyto(self._frames[slot], frame)
+        self._values[slot] = (timestamp, controller.speed, controller.rpm, controller.steering, controller.throttle,
+                              controller.brakes)
+        with self._cond:
+            if self._pending >= 0:
+                self.dropped += 1
+            self._pending = slot
+            self._cond.notify()
+
+    def close(self):
+        """
+        Дописывает ожидающий кадр, останавливает поток и закрывает запись
+        :return:
+        """
+        if not self._active:
+            return
+        with self._cond:
+            self._active = False
+            self._cond.notify()
+        self._thread.join()
+        self.recorder.close()
+
+
+class RecordReader:
+    """
+    Чтение файла записи. Все поля отдаются как представления NumPy поверх memory map, без копирования
+    """
+    def __init__(self, path: str):
+        """
+
+        :param path: путь к файлу записи
+        """
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if header.shape[0] != 1 or header['magic'][0] != MAGIC:
+            raise ValueError("{} is not a frame recording".format(path))
+        if header['version'][0] != VERSION:
+            raise ValueError("Unsupported recording version {}".format(header['version'][0]))
+        self.path = path
+        self.frame_shape: Tuple[int, int, int] = (
+            int(header['height'][0]), int(header['width'][0]), int(header['channels'][0])
+        )
+        count = int(header['count'][0])
+        if count:
+            self.records = np.memmap(path, dtype=record_dtype(*self.frame_shape), mode='r', offset=HEADER_SIZE,
+                                     shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=record_dtype(*self.frame_shape))
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        return iter(self.frames)
+
+    @property
+    def frames(self) -> np.ndarray:
+        """
+        Все кадры, массив (N, высота, ширина, каналы)
+        :return:
+        """
+        return self.records['frame']
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.records['timestamp']
+
+    @property
+    def speed(self) -> np.ndarray:
+        return self.records['speed']
+
+    @property
+    def rpm(self) -> np.ndarray:
+        return self.records['rpm']
+
+    @property
+    def steering(self) -> np.ndarray:
+        return self.records['steering']
+
+    @property
+    def throttle(self) -> np.ndarray:
+        return self.records['throttle']
+
+    @property
+    def brakes(self) -> np.ndarray:
+        return self.records['brakes']
@@ -1,10 +1,29 @@
-from typing import List, Tuple, Union, Any
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Tuple, Union
 import cv2
 import numpy as np
-import statistics
+
+from autopilot.metrics import COUNT_BUCKETS, NULL_METRICS, MetricsTimer
+from autopilot.smoothing import SlidingWindow
+from autopilot.timing import NULL_TIMER
+from autopilot.tracking import LaneTracker
 
 SLIDING_LINE_WINDOW = 5  # интервал усреднения положения линий
 DELTA_IF_ONE_OF_LINES_WASNT_DETECTED = 100
+MIN_ABS_SLOPE = 0.55  # минимальный модуль производной сегмента, который может быть линией разметки
+# запас вокруг прямоугольника зоны интереса, что бы размытие и Canny на его краях видели настоящих соседей пикселей
+ROI_BOX_MARGIN = 4
+TRACK_BAND_HALF_WIDTH = 30  # полуширина полосы поиска вокруг предсказанной линии в режиме трекинга, пиксели
+TRACK_STRIPS = 4  # на сколько горизонтальных полос делится полоса поиска, что бы описанные прямоугольники были узкими
+SCALE_LEVELS = (1.0, 0.75, 0.5, 0.375, 0.25)  # допустимые коэффициенты уменьшения изображения в адаптивном режиме
+SCALE_UP_RATIO = 0.5  # масштаб увеличивается, если задержка ниже этой доли бюджета (время растет как квадрат масштаба)
+SCALE_COOLDOWN = 10  # сколько кадров после смены масштаба не менять его снова, пока задержка не устоится
+LATENCY_SMOOTHING = 0.2  # вес нового замера в экспоненциальном среднем задержки
+FINGERPRINT_SIZE = (32, 16)  # ширина и высота уменьшенной копии зоны интереса для сравнения соседних кадров
+FINGERPRINT_SAMPLES = 4  # сколько точек по каждой оси выбирается на одну клетку отпечатка
+MAX_SKIPPED_FRAMES = 10  # сколько кадров подряд можно отдать из кэша, прежде чем искать линии заново
+WARMUP_FRAMES = 3  # сколько синтетических кадров прогоняет warm_up() на каждом масштабе
 
 LEFT_LINE_DETECTED_COLOR = (0, 255, 0)
 RIGHT_LINE_DETECTED_COLOR = (0, 0, 255)
@@ -15,6 +34,8 @@ ROI_BORDERS_COLOR = (255, 0, 0)
 CAR_DIRECTION_LINE = (110, 0, 180)
 GUESSED_LANE_CENTER_LINE = (180, 0, 110)
 
+NO_SEGMENTS = np.empty((0, 4), dtype=np.int64)
+
 
 class Point:
     """
@@ -100,6 +121,46 @@ class Line:
         return self.x2, self.y2
 
 
+class Detection:
+    """
+    Результат поиска полосы на одном кадре
+    """
+    __slots__ = (
+        'left_line', 'right_line', 'delta', 'segments', 'left_segments', 'right_segments', 'tracked', 'scale',
+        'cached'
+    )
+
+    def __init__(self):
+        self.left_line: Union[Line, None] = None  # усредненная левая линия разметки
+        self.right_line: Union[Line, None] = None  # усредненная правая линия разметки
+        self.delta: Union[float, None] = None  # отклонение середины полосы от центра изображения
+        self.segments: int = 0  # сколько всего сегментов нашел алгоритм Хафа
+        self.left_segments: np.ndarray = NO_SEGMENTS  # сегменты, похожие на левую линию, массив (N, 4)
+        self.right_segments: np.ndarray = NO_SEGMENTS  # сегменты, похожие на правую линию, массив (N, 4)
+        self.tracked: bool = False  # искались ли линии только вокруг предсказанных положений
+        self.scale: float = 1.  # во сколько раз было уменьшено изображение перед поиском краев
+        self.cached: bool = False  # кадр почти не отличался от предыдущего, и результат взят из кэша
+
+    def copy(self) -> 'Detection':
+        detection = Detection()
+        for name in self.__slots__:
+            setattr(detection, name, getattr(self, name))
+        return detection
+
+    @property
+    def left_count(self):
+        return self.left_segments.shape[0]
+
+    @property
+    def right_count(self):
+        return self.right_segments.shape[0]
+
+    def __repr__(self):
+        return "Detection(delta={}, segments={}, left={}, right={})".format(
+            self.delta, self.segments, self.left_count, self.right_count
+        )
+
+
 class Seeker:
     """
     Класс, определяющий границы полосы движения. Основан на алгоритмах
@@ -114,7 +175,14 @@ class Seeker:
             theta: float = np.pi / 180,
             threshold: int = 15,
             min_line_length: int = 40,
-            max_line_gap: int = 25
+            max_line_gap: int = 25,
+            metrics=NULL_METRICS,
+            tracking: bool = False,
+            track_band: int = TRACK_BAND_HALF_WIDTH,
+            parallel: bool = False,
+            frame_budget: Union[float, None] = None,
+            skip_threshold: Union[float, None] = None,
+            max_skip: int = MAX_SKIPPED_FRAMES
     ):
         """
 
@@ -126,6 +194,24 @@ class Seeker:
         :param threshold: параметр алгоритма Хафа, уровень чувствительности
         :param min_line_length: параметр алгоритма Хафа, минимальная длина линии
         :param max_line_gap: параметр алгоритма Хафа, максимальный разрыв между сегментами линии
+        :param metrics: autopilot.metrics.MetricsRegistry для времени стадий, количества сегментов и доли найденных
+            линий
+        :param tracking: предсказывать положение линий между кадрами и искать их только в узких полосах вокруг
+            предсказаний; если линия потеряна, поиск идет по всей зоне интереса
+        :param track_band: полуширина полосы поиска в режиме трекинга, пиксели
+        :param parallel: искать левую и правую линии одновременно в двух потоках, каждую в своей половине зоны
+            интереса (OpenCV отпускает GIL на время вычислений). В режиме трекинга полосы поиска обрабатываются в
+            одном потоке. Алгоритм Хафа на половинах находит сегменты иначе, чем на всей зоне: сегменты, пересекающие
+            центр, не находятся вовсе, поэтому количество сегментов и положение линий отличаются от поиска в одном
+            потоке (на записанных кадрах - на несколько пикселей)
+        :param frame_budget: целевое время обработки кадра, с. Если задано, изображение перед размытием, Canny и
+            алгоритмом Хафа уменьшается (параметры Хафа масштабируются вместе с ним), а коэффициент уменьшения
+            подстраивается под измеренную задержку. Полосы поиска режима трекинга не уменьшаются
+        :param skip_threshold: если задано, перед поиском зона интереса уменьшается до FINGERPRINT_SIZE и сравнивается
+            с такой же копией кадра, на котором линии искались последний раз. Если среднее абсолютное различие
+            (в уровнях яркости 0..255) меньше порога, линии не ищутся, а возвращается прошлый результат. Шум
+            снимков экрана дает около 0.5, сдвиг линий на несколько пикселей - больше 1
+        :param max_skip: сколько кадров подряд можно отдать из кэша; ограничивает возраст результата
         """
         self._crop_vertices: List[Point] = image_cropbox
         self._original_image_size: Point = Point(0, 0)
@@ -136,8 +222,53 @@ class Seeker:
         self._min_line_length: int = min_line_length
         self._max_line_gap: int = max_line_gap
 
-        self._left_sliding_line = []
-        self._right_sliding_line = []
+        # маска зоны интереса не меняется, поэтому строим ее один раз и только для описанного вокруг зоны прямоугольника
+        self._roi_box: List[Point] = self._create_roi_box()
+        self._roi_mask = self._create_roi_mask(self._roi_box)
+        self._frame_center: float = self._get_cropped_image_size().x / 2
+
+        # окна координат (x1, y1, x2, y2) последних линий
+        self._left_sliding_line = SlidingWindow(SLIDING_LINE_WINDOW, 4)
+        self._right_sliding_line = SlidingWindow(SLIDING_LINE_WINDOW, 4)
+
+        self._tracking = tracking
+        self._track_band = track_band
+        self._left_tracker = LaneTracker()
+        self._right_tracker = LaneTracker()
+        self._track_canvas = np.zeros_like(self._roi_mask)  # сюда собираются края, найденные в полосах поиска
+        self._tracked_metric = metrics.ratio('seeker.tracked_rate')
+
+        self._frame_budget = frame_budget
+        self._scale_level = 0
+        self._scale_cooldown = 0
+        self._latency = 0.  # экспоненциальное среднее времени обработки кадра
+        self._scaled_masks = {}  # (прямоугольник, масштаб) -> уменьшенная маска
+        self._scale_metric = metrics.histogram('seeker.scale', sorted(SCALE_LEVELS))
+
+        self._skip_threshold = skip_threshold
+        self._max_skip = max_skip
+        self._reference = None  # отпечаток кадра, на котором линии искались последний раз
+        self._cached: Union[Detection, None] = None
+        self._skipped = 0  # сколько кадров подряд отдано из кэша
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache_hits_metric = metrics.counter('seeker.cache_hits')
+        self._cache_misses_metric = metrics.counter('seeker.cache_misses')
+
+        self._pool = None
+        if parallel:
+            # левая половина уходит в пул, правая считается в вызывающем потоке
+            self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='seeker')
+            self._left_box, self._left_mask = self._create_half(True)
+            self._right_box, self._right_mask = self._create_half(False)
+
+        self.timer = NULL_TIMER  # замер времени стадий, см. autopilot.timing.StageTimer
+        if metrics is not NULL_METRICS:
+            self.timer = MetricsTimer(metrics, 'seeker')
+        self._segments_metric = metrics.histogram('seeker.segments', COUNT_BUCKETS)
+        self._left_metric = metrics.ratio('seeker.left_rate')
+        self._right_metric = metrics.ratio('seeker.right_rate')
+        self._both_metric = metrics.ratio('seeker.both_rate')
 
     def _crop_image(self, image):
         """
@@ -181,144 +312,394 @@ class Seeker:
     def _get_roi(self):
         return [x.pt for x in self._roi_vertices]
 
+    def _create_roi_box(self) -> List[Point]:
+        """
+        Прямоугольник, описанный вокруг зоны интереса (с небольшим запасом), в координатах обрезанного изображения
+        :return: левый верхний и правый нижний углы, как у кропбокса
+        """
+        size = self._get_cropped_image_size()
+        x, y, w, h = cv2.boundingRect(np.array(self._get_roi(), dtype=np.int32))
+        return [
+            Point(max(x - ROI_BOX_MARGIN, 0), max(y - ROI_BOX_MARGIN, 0)),
+            Point(min(x + w + ROI_BOX_MARGIN, size.x), min(y + h + ROI_BOX_MARGIN, size.y)),
+        ]
+
+    def _create_roi_mask(self, box: List[Point]):
+        """
+        Маска зоны интереса размером с прямоугольник box
+        :param box: прямоугольник, для которого строится маска
+        :return:
+        """
+        size = box[1] - box[0]
+        mask = np.zeros((size.y, size.x), dtype=np.uint8)
+        roi = np.array([self._get_roi()], dtype=np.int32) - np.array(box[0].pt, dtype=np.int32)
+        cv2.fillPoly(mask, roi, 255)
+        return mask
+
+    def _create_half(self, is_left) -> Tuple[List[Point], np.ndarray]:
+        """
+        Прямоугольник и маска половины зоны интереса по одну сторону от центра изображения. Прямоугольник берется с
+        запасом за центр, что бы края у центра считались так же, как для всей зоны, а маска обрезается точно по центру
+        :param is_left:
+        :return:
+        """
+        center = int(self._frame_center)
+        if is_left:
+            box = [self._roi_box[0], Point(min(center + ROI_BOX_MARGIN, self._roi_box[1].x), self._roi_box[1].y)]
+        else:
+            box = [Point(max(center - ROI_BOX_MARGIN, self._roi_box[0].x), self._roi_box[0].y), self._roi_box[1]]
+        mask = self._create_roi_mask(box)
+        center_in_box = center - box[0].x
+        if is_left:
+            mask[:, center_in_box:] = 0
+        else:
+            mask[:, :center_in_box] = 0
+        return box, mask
+
+    def _find_segments(self, image, box: List[Point], mask, timer=None):
+        """
+        Ищет сегменты линий только внутри прямоугольника box обрезанного изображения
+        :param image: обрезанное изображение
+        :param box: прямоугольник, в котором ищем сегменты
+        :param mask: маска размером с box
+        :param timer: таймер стадий, по умолчанию self.timer
+        :return: результат cv2.HoughLinesP в координатах обрезанного изображения
+        """
+        timer = self.timer if timer is None else timer
+        scale = self.scale
+        region = image[box[0].y:box[1].y, box[0].x:box[1].x]
+        gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)  # так надо
+        timer.lap('cvtColor')
+        if scale != 1.:
+            mask = self._get_scaled_mask(box, mask, scale)
+            # INTER_LINEAR заметно быстрее INTER_AREA при дробном масштабе, а перед Canny изображение все равно
+            # размывается
+            gray = cv2.resize(gray, (mask.shape[1], mask.shape[0]), interpolation=cv2.INTER_LINEAR)
+            timer.lap('resize')
+        blur = cv2.GaussianBlur(gray, (5, 5), 0)  # применяем гауссово размытие
+        timer.lap('GaussianBlur')
+        edges = cv2.Canny(blur, 50, 150)  # Canny edges detection
+        timer.lap('Canny')
+        masked_edges = cv2.bitwise_and(edges, mask)
+        timer.lap('mask')
+        # параметры в пикселях масштабируем вместе с изображением; порог - тоже, т.к. голосов за линию меньше во
+        # столько же раз, во сколько короче линия
+        lines = cv2.HoughLinesP(masked_edges, rho=self._rho * scale, theta=self._theta,
+                                threshold=max(int(round(self._threshold * scale)), 1),
+                                minLineLength=self._min_line_length * scale,
+                                maxLineGap=self._max_line_gap * scale)  # алгоритм Хафа
+        if lines is not None:
+            if scale != 1.:
+                lines = np.rint(lines / scale).astype(np.int32)  # обратно в координаты исходного изображения
+            lines += np.array([box[0].x, box[0].y, box[0].x, box[0].y], dtype=lines.dtype)
+        timer.lap('HoughLinesP')
+        return lines
+
+    def _get_scaled_mask(self, box: List[Point], mask, scale: float):
+        """
+        Уменьшенная копия маски прямоугольника box, строится один раз для каждого масштаба
+        :param box:
+        :param mask: маска в полном размере
+        :param scale:
+        :return:
+        """
+        key = (box[0].pt, box[1].pt, scale)
+        scaled = self._scaled_masks.get(key)
+        if scaled is None:
+            size = (max(int(round(mask.shape[1] * scale)), 1), max(int(round(mask.shape[0] * scale)), 1))
+            scaled = self._scaled_masks[key] = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+        return scaled
+
+    @property
+    def scale(self) -> float:
+        """
+        Текущий коэффициент уменьшения изображения
+        :return:
+        """
+        return SCALE_LEVELS[self._scale_level]
+
+    @scale.setter
+    def scale(self, value: float):
+        """
+        Устанавливает ближайший допустимый масштаб, например, сохраненный с прошлого запуска
+        :param value:
+        :return:
+        """
+        self._scale_level = min(range(len(SCALE_LEVELS)), key=lambda i: abs(SCALE_LEVELS[i] - value))
+        self._scale_cooldown = SCALE_COOLDOWN
+
+    def _adapt_scale(self, latency: float):
+        """
+        Подстраивает масштаб под бюджет времени кадра: уменьшает изображение, если средняя задержка выше бюджета, и
+        увеличивает, если задержка заметно ниже
+        :param latency: время обработки последнего кадра, с
+        :return:
+        """
+        self._latency += LATENCY_SMOOTHING * (latency - self._latency) if self._latency else latency
+        if self._scale_cooldown:
+            self._scale_cooldown -= 1
+            return
+        if self._latency > self._frame_budget and self._scale_level < len(SCALE_LEVELS) - 1:
+            self._scale_level += 1
+        elif self._latency < self._frame_budget * SCALE_UP_RATIO and self._scale_level > 0:
+            self._scale_level -= 1
+        else:
+            return
+        self._scale_cooldown = SCALE_COOLDOWN
+
+    def _find_half(self, image, is_left) -> Tuple[int, np.ndarray, Union[Line, None]]:
+        """
+        Поиск одной линии в своей половине зоны интереса. Выполняется в пуле потоков, поэтому время стадий не
+        замеряется: таймер общий для всего кадра
+        :param image: обрезанное изображение
+        :param is_left:
+        :return: (количество найденных сегментов, сегменты этой стороны, усредненная линия). Сегменты считаются
+            только по свою сторону от центра, что бы сегмент из запаса прямоугольника за центром не попал в сумму
+            обеих половин дважды
+        """
+        box, mask = (self._left_box, self._left_mask) if is_left else (self._right_box, self._right_mask)
+        lines = self._find_segments(image, box, mask, NULL_TIMER)
+        if lines is None:
+            return 0, NO_SEGMENTS, None
+        # сторону определяет середина сегмента: каждый сегмент относится ровно к одной половине
+        ends = lines.reshape(-1, 4)
+        doubled_middle = ends[:, 0] + ends[:, 2]
+        own = doubled_middle < 2 * self._frame_center if is_left else doubled_middle >= 2 * self._frame_center
+        left_segments, right_segments = self._classify_segments(lines)
+        segments = left_segments if is_left else right_segments
+        line = self._calc_average_line(segments, is_left) if segments.shape[0] > 0 else None
+        return int(np.count_nonzero(own)), segments, line
+
+    def _line_to_track(self, line: Union[Line, None]) -> Union[Tuple[float, float], None]:
+        """
+        Переводит линию в координаты трекера: x в верхней и нижней строках прямоугольника зоны интереса
+        :param line:
+        :return:
+        """
+        if line is None or line.y1 == line.y2:
+            return None
+        inverse_slope = (line.x2 - line.x1) / (line.y2 - line.y1)
+        return (
+            line.x1 + (self._roi_box[0].y - line.y1) * inverse_slope,
+            line.x1 + (self._roi_box[1].y - line.y1) * inverse_slope,
+        )
+
+    def _find_segments_tracked(self, image, predictions):
+        """
+        Ищет сегменты линий только в узких полосах вокруг предсказанных положений линий. Каждая полоса режется на
+        TRACK_STRIPS горизонтальных кусков, края считаются только в описанных вокруг кусков прямоугольниках и
+        собираются на общий холст размером с зону интереса, по которому один раз запускается алгоритм Хафа
+        :param image: обрезанное изображение
+        :param predictions: предсказания трекеров, (x сверху, x снизу) для каждой линии
+        :return: результат cv2.HoughLinesP в координатах обрезанного изображения
+        """
+        top, bottom = self._roi_box[0].y, self._roi_box[1].y
+        left, right = self._roi_box[0].x, self._roi_box[1].x
+        canvas = self._track_canvas
+        canvas[:] = 0
+        strip_height = (bottom - top) / TRACK_STRIPS
+        for x_top, x_bottom in predictions:
+            for k in range(TRACK_STRIPS):
+                y0 = int(top + k * strip_height)
+                y1 = int(top + (k + 1) * strip_height)
+                xa = x_top + (x_bottom - x_top) * (y0 - top) / (bottom - top)
+                xb = x_top + (x_bottom - x_top) * (y1 - top) / (bottom - top)
+                x0 = max(int(min(xa, xb)) - self._track_band, left)
+                x1 = min(int(max(xa, xb)) + self._track_band, right)
+                if x1 <= x0:
+                    continue
+                # считаем края с запасом, что бы размытие и Canny на краях куска видели настоящих соседей
+                mx0, my0 = max(x0 - ROI_BOX_MARGIN, 0), max(y0 - ROI_BOX_MARGIN, 0)
+                mx1, my1 = min(x1 + ROI_BOX_MARGIN, image.shape[1]), min(y1 + ROI_BOX_MARGIN, image.shape[0])
+                gray = cv2.cvtColor(image[my0:my1, mx0:mx1], cv2.COLOR_BGR2GRAY)
+                blur = cv2.GaussianBlur(gray, (5, 5), 0)
+                edges = cv2.Canny(blur, 50, 150)
+                target = canvas[y0 - top:y1 - top, x0 - left:x1 - left]
+                np.bitwise_or(target, edges[y0 - my0:y1 - my0, x0 - mx0:x1 - mx0], out=target)
+        self.timer.lap('tracked_edges')
+        cv2.bitwise_and(canvas, self._roi_mask, dst=canvas)
+        self.timer.lap('mask')
+        lines = cv2.HoughLinesP(canvas, rho=self._rho, theta=self._theta, threshold=self._threshold,
+                                minLineLength=self._min_line_length, maxLineGap=self._max_line_gap)  # алгоритм Хафа
+        if lines is not None:
+            lines += np.array([left, top, left, top], dtype=lines.dtype)
+        self.timer.lap('HoughLinesP')
+        return lines
+
     def _resize_line_image(self, line_image):
         """
         Дополняет изображение с линиями до размеров исходного кадра
         :param line_image:
         :return:
         """
-        im = np.zeros((self._original_image_size.y, self._original_image_size.x, 4))
+        im = np.zeros((self._original_image_size.y, self._original_image_size.x) + line_image.shape[2:],
+                      dtype=line_image.dtype)
         im[self._crop_vertices[0].y:self._crop_vertices[1].y,
         self._crop_vertices[0].x:self._crop_vertices[1].x] = line_image
         return im
 
     @staticmethod
-    def _average_line(line_list):
+    def _average_line(sliding_line: SlidingWindow) -> Line:
         """
-        Возвращает усредненную линию, полученную из массива линий
-        :param line_list:
+        Возвращает усредненную линию, полученную из окна линий. Координаты целые и неотрицательные, поэтому среднее,
+        округленное вниз, совпадает с отбрасыванием дробной части в Line
+        :param sliding_line:
         :return:
         """
-        return Line(
-                statistics.mean([l.x1 for l in line_list]),
-                statistics.mean([l.y1 for l in line_list]),
-                statistics.mean([l.x2 for l in line_list]),
-                statistics.mean([l.y2 for l in line_list])
-            )
+        return Line(*sliding_line.floor_mean())
+
+    @staticmethod
+    def _split_mean(values: np.ndarray) -> Tuple[Union[int, None], Union[int, None]]:
+        """
+        Делит значения по их среднему и возвращает средние обеих половин (округленные вниз, как при создании Point).
+        Сравнение со средним ведется в целых числах, без погрешностей float-а
+        :param values: одномерный массив неотрицательных целых координат
+        :return: (среднее значений больше общего среднего, среднее значений меньше общего среднего), None вместо
+            среднего пустой половины
+        """
+        n = values.shape[0]
+        total = values.sum()
+        scaled = values * n
+        gt = values[scaled > total]
+        lt = values[scaled < total]
+        return (
+            int(gt.sum()) // gt.shape[0] if gt.shape[0] else None,
+            int(lt.sum()) // lt.shape[0] if lt.shape[0] else None
+        )
 
-    def _calc_average_line(self, xs, ys, is_left) -> Union[Line, None]:
+    def _calc_average_line(self, segments: np.ndarray, is_left) -> Union[Line, None]:
         """
         Вычисляет усредненную линию, используя скользящее среднее каждой координаты
-        :param xs:
-        :param ys:
+        :param segments: массив (N, 4) сегментов одной стороны
         :param is_left:
         :return:
         """
-        try:
-            mean_x = statistics.mean(xs)
-            mean_y = statistics.mean(ys)
-            xs_gt_mean = list(filter(lambda x: x > mean_x, xs))
-            ys_gt_mean = list(filter(lambda y: y > mean_y, ys))
-            xs_lt_mean = list(filter(lambda x: x < mean_x, xs))
-            ys_lt_mean = list(filter(lambda y: y < mean_y, ys))
-            if is_left:
-                if len(self._left_sliding_line) == SLIDING_LINE_WINDOW:
-                    self._left_sliding_line.pop(0)
-                self._left_sliding_line.append(
-                    Line(
-                        statistics.mean(xs_gt_mean),
-                        statistics.mean(ys_lt_mean),
-                        statistics.mean(xs_lt_mean),
-                        statistics.mean(ys_gt_mean)
-                    )
-                )
-                line = self._average_line(self._left_sliding_line)
-            else:
-                if len(self._right_sliding_line) == SLIDING_LINE_WINDOW:
-                    self._right_sliding_line.pop(0)
-                self._right_sliding_line.append(
-                    Line(
-                        statistics.mean(xs_lt_mean),
-                        statistics.mean(ys_lt_mean),
-                        statistics.mean(xs_gt_mean),
-                        statistics.mean(ys_gt_mean)
-                    )
-                )
-                line = self._average_line(self._right_sliding_line)
-            return line
-        except statistics.StatisticsError:
+        xs = np.concatenate((segments[:, 0], segments[:, 2]))
+        ys = np.concatenate((segments[:, 1], segments[:, 3]))
+        x_gt_mean, x_lt_mean = self._split_mean(xs)
+        y_gt_mean, y_lt_mean = self._split_mean(ys)
+        sliding_line = self._left_sliding_line if is_left else self._right_sliding_line
+        if len(sliding_line) == SLIDING_LINE_WINDOW:
+            sliding_line.drop_oldest()
+        if x_gt_mean is None or x_lt_mean is None or y_gt_mean is None or y_lt_mean is None:
             return None
-
-    def _detect_lines(self, image) -> Tuple[Any, Union[Line, None], Union[Line, None]]:
-        """
-        Основная функция, в которой происходит поиск линий и все вычисления
+        if is_left:
+            line = Line(x_gt_mean, y_lt_mean, x_lt_mean, y_gt_mean)
+        else:
+            line = Line(x_lt_mean, y_lt_mean, x_gt_mean, y_gt_mean)
+        sliding_line.push((line.x1, line.y1, line.x2, line.y2))
+        return self._average_line(sliding_line)
+
+    def _classify_segments(self, lines) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Делит все сегменты, найденные алгоритмом Хафа, на похожие на левую и правую линии разметки за один проход по
+        массиву
+        :param lines: результат cv2.HoughLinesP, массив (N, 1, 4)
+        :return: массивы (M, 4) левых и правых сегментов; начало каждого сегмента левее его конца, как в Line
+        """
+        raw = lines.reshape(-1, 4).astype(np.int64)
+        swap = raw[:, 0] >= raw[:, 2]  # упорядочиваем концы сегментов так же, как Line
+        segments = np.where(swap[:, None], raw[:, [2, 3, 0, 1]], raw)
+        x1, y1, x2, y2 = segments.T
+        dx = x2 - x1
+        slope = np.divide(y2 - y1, dx, out=np.zeros(dx.shape[0]), where=dx != 0)
+        steep = np.abs(slope) > MIN_ABS_SLOPE  # отсекаем горизонтальные и малонаклоненные линии
+        center = self._frame_center
+        # если производная больше нуля, значит, линия должна быть похожа на правую линию разметки,
+        # но если линия находится левее центра изображения - она нас не интересует
+        right = steep & (slope > 0) & (x1 > center) & (x2 > center)
+        left = steep & (slope <= 0) & (x1 < center) & (x2 < center)
+        return segments[left], segments[right]
+
+    def _find_lines(self, image) -> Detection:
+        """
+        Основная функция, в которой происходит поиск линий и все вычисления. Ничего не рисует и не выделяет памяти под
+        изображения
         :param image:
         :return:
         """
+        self.timer.start()
         image = self._crop_image(image)  # обрезаем изображение
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)  # так надо
-        blur = cv2.GaussianBlur(gray, (5, 5), 0)  # применяем гауссово размытие
-        edges = cv2.Canny(blur, 50, 150)  # Canny edges detection
-        mask_color = 255
-        mask = np.zeros_like(edges)
-        cv2.fillPoly(mask, np.array([self._get_roi()], dtype=np.int32), mask_color)
-        masked_edges = cv2.bitwise_and(edges, mask)
-        lines = cv2.HoughLinesP(masked_edges, rho=self._rho, theta=self._theta, threshold=self._threshold,
-                                minLineLength=self._min_line_length, maxLineGap=self._max_line_gap)  # алгоритм Хафа
+        self.timer.lap('crop')
+        detection = Detection()
+        # ищем в полосах вокруг предсказаний, только если отслеживаются обе линии, иначе - по всей зоне интереса
+        detection.tracked = self._tracking and self._left_tracker.tracked and self._right_tracker.tracked
+        detection.scale = 1. if detection.tracked else self.scale
+        lines = None
+        if detection.tracked:
+            lines = self._find_segments_tracked(image, (self._left_tracker.predict(), self._right_tracker.predict()))
+        elif self._pool is not None:
+            # половины зоны интереса обрабатываются одновременно, сегменты и средние линии каждой стороны независимы
+            left = self._pool.submit(self._find_half, image, True)
+            right_count, detection.right_segments, detection.right_line = self._find_half(image, False)
+            left_count, detection.left_segments, detection.left_line = left.result()
+            detection.segments = left_count + right_count
+            self.timer.lap('parallel_halves')
+        else:
+            lines = self._find_segments(image, self._roi_box, self._roi_mask)
 
-        line_image = np.zeros_like(image)  # Пустое изображение для визуализации
+        if lines is not None:
+            detection.segments = lines.shape[0]
+            detection.left_segments, detection.right_segments = self._classify_segments(lines)
+            self.timer.lap('classification')
 
+            # Вычисляем усредненные левую и правую линии, отражающие найденную разметку на дороге
+            if detection.left_segments.shape[0] > 0:
+                detection.left_line = self._calc_average_line(detection.left_segments, True)
+            if detection.right_segments.shape[0] > 0:
+                detection.right_line = self._calc_average_line(detection.right_segments, False)
+
+        detection.delta = self._calc_delta(detection.left_line, detection.right_line)
+        if self._tracking:
+            self._left_tracker.update(self._line_to_track(detection.left_line))
+            self._right_tracker.update(self._line_to_track(detection.right_line))
+        self.timer.lap('averaging')
+        return detection
+
+    def _calc_delta(self, left_line: Union[Line, None], right_line: Union[Line, None]) -> Union[float, None]:
+        """
+        Отклонение середины полосы от центра изображения
+        :param left_line:
+        :param right_line:
+        :return:
+        """
+        if left_line is not None and right_line is not None:  # если определены обе линии, считаем средний x между их средними координатами x
+            average_x_of_left = int((left_line.x1 + left_line.x2) / 2)
+            average_x_of_right = int((right_line.x1 + right_line.x2) / 2)
+            guessed_center = int((average_x_of_right + average_x_of_left) / 2)
+            # guessed_center = int((left_line.x1 + right_line.x2) / 2)
+            return self._frame_center - guessed_center
+        # иначе, применяем ЭМПИРИЧЕСКУЮ величину отклонения
+        if left_line is not None:
+            return -DELTA_IF_ONE_OF_LINES_WASNT_DETECTED
+        if right_line is not None:
+            return DELTA_IF_ONE_OF_LINES_WASNT_DETECTED
+        return None
+
+    def _draw_lines(self, line_image, detection: Detection):
+        """
+        Рисует зону интереса, найденные сегменты и усредненные линии
+        :param line_image: изображение размером с обрезанный кадр
+        :param detection:
+        :return:
+        """
         # Накладываем зону интереса
         cv2.line(line_image, self._roi_vertices[0].pt, self._roi_vertices[1].pt, ROI_BORDERS_COLOR, 1)
         cv2.line(line_image, self._roi_vertices[1].pt, self._roi_vertices[2].pt, ROI_BORDERS_COLOR, 1)
         cv2.line(line_image, self._roi_vertices[2].pt, self._roi_vertices[3].pt, ROI_BORDERS_COLOR, 1)
         cv2.line(line_image, self._roi_vertices[3].pt, self._roi_vertices[0].pt, ROI_BORDERS_COLOR, 1)
 
-        if lines is not None:
-            left_lines = []
-            right_lines = []
-
-            for line in lines:
-                _l = Line(*line[0])
-
-                if abs(_l.slope) > 0.55:  # отсекаем горизонтальные и малонаклоненные линии
-                    center = (self._crop_vertices[1] - self._crop_vertices[0]).x / 2
-                    if _l.slope > 0:  # если производная больше нуля, значит, линия должна быть похожа на правую линию разметки
-                        if _l.x1 > center and _l.x2 > center:  # но если линия находится левее центра изображения - она нас не интересует
-                            cv2.line(line_image, _l.pt1, _l.pt2, RIGHT_LINE_DETECTED_COLOR, 1)  # рисуем линию
-                            right_lines.append(_l)
-                    else:
-                        if _l.x1 < center and _l.x2 < center:
-                            cv2.line(line_image, _l.pt1, _l.pt2, LEFT_LINE_DETECTED_COLOR, 1)
-                            left_lines.append(_l)
-                else:
-                    # cv2.line(line_image, _l.pt1, _l.pt2, FILTERED_OUT_LINES_DETECTED_COLOR, 1)
-                    pass
-
-            left_line = None
-            right_line = None
+        # рисуем все подходящие сегменты разом
+        cv2.polylines(line_image, detection.left_segments.reshape(-1, 2, 2).astype(np.int32), False,
+                      LEFT_LINE_DETECTED_COLOR, 1)
+        cv2.polylines(line_image, detection.right_segments.reshape(-1, 2, 2).astype(np.int32), False,
+                      RIGHT_LINE_DETECTED_COLOR, 1)
 
-            # Вычисляем усредненные левую и правую линии, отражающие найденную разметку на дороге
-            if len(left_lines) > 0:
-                left_xs = [x.x1 for x in left_lines]
-                left_xs.extend([x.x2 for x in left_lines])
-                left_ys = [x.y1 for x in left_lines]
-                left_ys.extend([x.y2 for x in left_lines])
-                left_line = self._calc_average_line(left_xs, left_ys, True)
-                if left_line is not None:
-                    cv2.line(line_image, left_line.pt1, left_line.pt2, LEFT_LINE_BORDER_COLOR, 3)
-            if len(right_lines) > 0:
-                right_xs = [x.x1 for x in right_lines]
-                right_xs.extend([x.x2 for x in right_lines])
-                right_ys = [x.y1 for x in right_lines]
-                right_ys.extend([x.y2 for x in right_lines])
-                right_line = self._calc_average_line(right_xs, right_ys, False)
-                if right_line is not None:
-                    cv2.line(line_image, right_line.pt1, right_line.pt2, RIGHT_LINE_BORDER_COLOR, 3)
-
-            return line_image, left_line, right_line
-
-        return line_image, None, None
+        if detection.left_line is not None:
+            cv2.line(line_image, detection.left_line.pt1, detection.left_line.pt2, LEFT_LINE_BORDER_COLOR, 3)
+        if detection.right_line is not None:
+            cv2.line(line_image, detection.right_line.pt1, detection.right_line.pt2, RIGHT_LINE_BORDER_COLOR, 3)
+        return line_image
 
     def _direction_overlay(self, delta, line_image):
         """
@@ -345,6 +726,141 @@ class Seeker:
             cv2.line(overlay, guessed_drive_line_center.pt1, guessed_drive_line_center.pt2, GUESSED_LANE_CENTER_LINE, 2)
         return overlay
 
+    def _unchanged(self, image) -> bool:
+        """
+        Строит отпечаток зоны интереса и сравнивает его с отпечатком кадра, на котором линии искались последний раз
+        :param image: необрезанный кадр
+        :return: True, если можно отдать результат из кэша
+        """
+        self.timer.start()
+        box = self._crop_image(image)[self._roi_box[0].y:self._roi_box[1].y, self._roi_box[0].x:self._roi_box[1].x]
+        # INTER_AREA по всей зоне интереса занимает миллисекунды, поэтому сначала берем редкую сетку точек, а
+        # усредняем уже ее
+        width, height = FINGERPRINT_SIZE
+        samples = cv2.resize(box, (width * FINGERPRINT_SAMPLES, height * FINGERPRINT_SAMPLES),
+                             interpolation=cv2.INTER_NEAREST)
+        fingerprint = cv2.resize(samples, FINGERPRINT_SIZE, interpolation=cv2.INTER_AREA)
+        # альфа-канал снимков экрана постоянен и в разницу ничего не добавляет, поэтому делим только на цветовые
+        values = width * height * (min(box.shape[2], 3) if box.ndim == 3 else 1)
+        unchanged = (
+            self._reference is not None and self._skipped < self._max_skip
+            and cv2.norm(fingerprint, self._reference, cv2.NORM_L1) < self._skip_threshold * values
+        )
+        if not unchanged:
+            self._reference = fingerprint
+        self.timer.lap('fingerprint')
+        return unchanged
+
+    def detect(self, image) -> Detection:
+        """
+        Поиск полосы без какой-либо визуализации, для работы без дисплея
+        :param image:
+        :return:
+        """
+        if self._skip_threshold is not None:
+            if self._unchanged(image):
+                self._skipped += 1
+                self.cache_hits += 1
+                self._cache_hits_metric.inc()
+                detection = self._cached.copy()
+                detection.cached = True
+                return detection
+            self._skipped = 0
+            self.cache_misses += 1
+            self._cache_misses_metric.inc()
+
+        started = time.perf_counter()
+        detection = self._find_lines(image)
+        self._cached = detection
+        if self._frame_budget is not None:
+            self._adapt_scale(time.perf_counter() - started)
+        self._scale_metric.observe(detection.scale)
+        self._segments_metric.observe(detection.segments)
+        self._left_metric.observe(detection.left_line is not None)
+        self._right_metric.observe(detection.right_line is not None)
+        self._both_metric.observe(detection.left_line is not None and detection.right_line is not None)
+        self._tracked_metric.observe(detection.tracked)
+        return detection
+
+    def reset(self):
+        """
+        Забывает все, что накоплено по прошлым кадрам: окна усреднения линий, трекинг, кэш пропуска кадров и
+        среднюю задержку. Масштаб остается прежним
+        :return:
+        """
+        self._left_sliding_line.clear()
+        self._right_sliding_line.clear()
+        self._left_tracker.reset()
+        self._right_tracker.reset()
+        self._reference = None
+        self._cached = None
+        self._skipped = 0
+        self._latency = 0.
+
+    def warm_up(self, frames: int = WARMUP_FRAMES, channels: int = 4, draw: bool = False):
+        """
+        Прогоняет поиск линий на синтетических кадрах с двумя линиями разметки внутри зоны интереса, что бы ленивая
+        инициализация OpenCV, выделение буферов и маски всех масштабов случились до начала движения, а не на первых
+        настоящих кадрах. Метрики при этом не пишутся, а состояние после прогона сбрасывается
+        :param frames: сколько кадров прогнать на каждом масштабе
+        :param channels: количество каналов настоящих кадров (ScreenGrabber отдает BGRA)
+        :param draw: прогнать заодно и рисование данных
+        :return:
+        """
+        image = np.full((self._crop_vertices[1].y, self._crop_vertices[1].x, channels), 96, dtype=np.uint8)
+        offset = self._crop_vertices[0]
+        bottom_left, top_left, top_right, bottom_right = self._roi_vertices
+
+        def inside(a: Point, b: Point, t: float) -> Tuple[int, int]:
+            return int(a.x + (b.x - a.x) * t) + offset.x, int(a.y + (b.y - a.y) * t) + offset.y
+
+        for t in (0.1, 0.9):
+            cv2.line(image, inside(bottom_left, bottom_right, t), inside(top_left, top_right, t), (255,) * channels, 6)
+
+        timer, self.timer = self.timer, NULL_TIMER
+        scale_level = self._scale_level
+        try:
+            levels = range(len(SCALE_LEVELS)) if self._frame_budget is not None else (scale_level,)
+            for level in levels:
+                self._scale_level = level
+                for _ in range(frames):
+                    detection = self._find_lines(image)
+                    if draw:
+                        self.draw(image, detection)
+            if self._skip_threshold is not None:
+                self._unchanged(image)
+        finally:
+            self.timer = timer
+            self._scale_level = scale_level
+            self.reset()
+
+    def close(self):
+        """
+        Останавливает пул потоков параллельного режима
+        :return:
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def draw(self, image, detection: Detection, out=None):
+        """
+        Рисует данные, найденные detect(), поверх обрезанного кадра. Вызывается только когда картинку кто-то смотрит
+        :param image: тот же кадр, что был передан в detect()
+        :param detection:
+        :param out: куда положить результат (например, буфер общей памяти окна просмотра); по умолчанию новый массив
+        :return:
+        """
+        self.timer.start()
+        box = self._crop_image(image)
+        line_image = self._draw_lines(np.zeros_like(box), detection)  # Пустое изображение для визуализации
+        directions_image = self._direction_overlay(detection.delta, line_image)
+        # сложение с насыщением, то же, что addWeighted с весами 1, но без перевода в float и обратно
+        cv2.add(directions_image, line_image, dst=line_image)
+        final_image = cv2.add(box, line_image, dst=out)
+        self.timer.lap('overlay')
+        return final_image
+
     def process_frame(self, image, show_data=False):
         """
         Основной метод, с которым взаимодействует пользователь
@@ -352,28 +868,17 @@ class Seeker:
         :param show_data:
         :return:
         """
-        line_image, left_line, right_line = self._detect_lines(image)
-        delta = None
-        if left_line is not None and right_line is not None:  # если определены обе линии, считаем средний x между их средними координатами x
-            average_x_of_left = int((left_line.x1 + left_line.x2) / 2)
-            average_x_of_right = int((right_line.x1 + right_line.x2) / 2)
-            guessed_center = int((average_x_of_right + average_x_of_left) / 2)
-            # guessed_center = int((left_line.x1 + right_line.x2) / 2)
-            frame_center = line_image.shape[:2][1] / 2
-            delta = frame_center - guessed_center
-        else:  # иначе, применяем ЭМПИРИЧЕСКУЮ величину отклонения
-            if left_line is not None and right_line is None:
-                delta = -DELTA_IF_ONE_OF_LINES_WASNT_DETECTED
-            elif right_line is not None and left_line is None:
-                delta = DELTA_IF_ONE_OF_LINES_WASNT_DETECTED
-            else:
-                delta = None
+        detection = self.detect(image)
         if show_data:  # рисовать нам данные поверх кадра?
-            directions_image = self._direction_overlay(delta, line_image)
-            _image = cv2.addWeighted(directions_image, 1, line_image, 1, 0, dtype=0)
-            final_image = image # cv2.addWeighted(image, 0.6, _image, 1, 0, dtype=0)
-            box = final_image[self._crop_vertices[0].y:self._crop_vertices[1].y, self._crop_vertices[0].x:self._crop_vertices[1].x]
-            final_image = cv2.addWeighted(box, 1, _image, 1, 0, dtype=0)
-        else:
-            final_image = image
-        return final_image, delta
+            return self.draw(image, detection), detection.delta
+        return image, detection.delta
+
+    def process_frames(self, images: Iterable, show_data=False) -> Iterator[Tuple[object, Union[float, None]]]:
+        """
+        То же, что process_frame, для последовательности кадров (например, из записи или видео)
+        :param images: кадры по порядку
+        :param show_data:
+        :return: генератор пар (кадр, отклонение)
+        """
+        for image in images:
+            yield self.process_frame(image, show_data)
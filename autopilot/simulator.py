@@ -0,0 +1,298 @@
+"""
+Заменитель игры для проверки Controller без BeamNG: отвечает на сопряжение 'beamng|имя|код', шлет пакеты OutGauge
+с заданной частотой и принимает пакеты управления '>4f', считая потери, перестановки и задержку по времени отправки
+внутри пакета. Все работает по UDP, в том числе на loopback одной машины.
+
+    python -m autopilot.simulator --code 46611                    # ждать настоящий автопилот
+    python -m autopilot.simulator --code 46611 --time-origin 1700000000   # то же, с замером задержки
+    python -m autopilot.simulator --code 46611 --drive 200 --duration 10   # нагрузочный тест Controller
+
+Задержка считается, только если известен time_origin клиента: по умолчанию клиент шлет миллисекунды от начала эпохи,
+а во float32 они огрублены до двух минут. Для замера клиенту и заменителю задается один и тот же момент
+(Controller(time_origin=...) и --time-origin); нагрузочный тест делает это сам.
+"""
+import argparse
+import math
+import socket
+import threading
+import time
+from typing import Dict, Optional
+
+from autopilot.controller import CONTROL_PACKET, RECV_PORT, SEND_PORT
+from autopilot.metrics import Histogram
+from autopilot.telemetry import OUTGAUGE_PACKET
+
+OUTGAUGE_RATE = 60.  # сколько пакетов телеметрии в секунду шлет игра
+MAX_ACCELERATION = 4.  # м/с² при полном газе
+MAX_DECELERATION = 9.  # м/с² при полном тормозе
+DRAG = 0.015  # замедление от сопротивления, доля скорости в секунду
+RPM_PER_SPEED = 120.  # оборотов в минуту на 1 м/с, без коробки передач
+IDLE_RPM = 800.
+
+
+class ControlStats:
+    """
+    Статистика принятых пакетов управления. В пакете нет номера, поэтому перестановка определяется по времени
+    отправки меньше уже виденного, а потери - сравнением с количеством отправленных пакетов
+    """
+    def __init__(self):
+        self.received = 0
+        self.reordered = 0  # пакеты, пришедшие после более позднего
+        self.duplicates = 0  # пакеты с уже виденным временем отправки
+        self.latency = Histogram()  # секунды от отправки до получения
+        self.gaps = Histogram()  # секунды между соседними пакетами; дыры в потоке видны по хвосту
+        self.last_timestamp = -math.inf
+        self.last_arrival = 0.
+
+    def observe(self, timestamp_ms: float, now_ms: Optional[float], arrival: float):
+        """
+        Учитывает пакет
+        :param timestamp_ms: время отправки из пакета
+        :param now_ms: время получения в той же шкале или None, если шкала отправителя неизвестна
+        :param arrival: время получения по time.monotonic()
+        :return:
+        """
+        self.received += 1
+        if timestamp_ms < self.last_timestamp:
+            self.reordered += 1
+        elif timestamp_ms == self.last_timestamp:
+            self.duplicates += 1
+        else:
+            self.last_timestamp = timestamp_ms
+        if now_ms is not None:
+            self.latency.observe(max(0., now_ms - timestamp_ms) / 1000)
+        if self.last_arrival:
+            self.gaps.observe(arrival - self.last_arrival)
+        self.last_arrival = arrival
+
+    def lost(self, sent: int) -> int:
+        """
+        Сколько пакетов потеряно
+        :param sent: сколько пакетов отправил клиент (счетчик controller.sent)
+        :return:
+        """
+        return max(0, sent - self.received)
+
+    def snapshot(self) -> Dict[str, float]:
+        result = {'received': self.received, 'reordered': self.reordered, 'duplicates': self.duplicates}
+        result.update(self.latency.snapshot('latency'))
+        result.update(self.gaps.snapshot('gap'))
+        return result
+
+
+class BeamNGSimulator:
+    """
+    UDP-заменитель игры с одной простейшей машиной: газ разгоняет, тормоз замедляет, обороты пропорциональны
+    скорости
+    """
+    def __init__(self, security_code: int, host: str = '127.0.0.1', port: int = SEND_PORT,
+                 client_port: int = RECV_PORT, outgauge_rate: float = OUTGAUGE_RATE,
+                 time_origin: Optional[float] = None):
+        """
+
+        :param security_code: код безопасности, который должен прислать клиент
+        :param host: адрес, на котором игра ждет клиента
+        :param port: порт для сопряжения и пакетов управления (send_port клиента)
+        :param client_port: порт клиента для телеметрии (recv_port клиента)
+        :param outgauge_rate: частота пакетов OutGauge, пакетов в секунду
+        :param time_origin: начало отсчета времени в пакетах управления (Controller.time_origin); без него задержка
+            не считается
+        """
+        self.security_code = security_code
+        self.client_port = client_port
+        self.outgauge_rate = outgauge_rate
+        self.time_origin = time_origin
+
+        self.client_name: Optional[str] = None
+        self.client_host: Optional[str] = None
+        self.stats = ControlStats()
+        self.outgauge_sent = 0
+
+        self.steering = 0.5
+        self.throttle = 0.
+        self.brakes = 0.
+        self.speed = 0.  # м/с
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self._socket.settimeout(0.1)
+        self._socket.bind((host, port))
+        self._paired = threading.Event()
+        self._active = False
+        self._recv_thread = None
+        self._outgauge_thread = None
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    @property
+    def paired(self) -> bool:
+        return self._paired.is_set()
+
+    def wait_paired(self, timeout: Optional[float] = None) -> bool:
+        return self._paired.wait(timeout)
+
+    def _handle_pair(self, data: bytes, sender) -> bool:
+        """
+        Отвечает на запрос сопряжения 'beamng|имя|код'
+        :param data:
+        :param sender: адрес отправителя
+        :return: был ли это запрос сопряжения
+        """
+        if not data.startswith(b'beamng|'):
+            return False
+        try:
+            _, name, code = data.decode('utf-8').split('|')
+        except ValueError:
+            return True
+        if code != str(self.security_code):
+            return True  # как и игра, на неверный код не отвечаем
+        self.client_name, self.client_host = name, sender[0]
+        self._socket.sendto(('beamng|' + code).encode('utf-8'), (self.client_host, self.client_port))
+        self._paired.set()
+        return True
+
+    def _recv_cycle(self):
+        buffer = bytearray(256)
+        while self._active:
+            try:
+                size, sender = self._socket.recvfrom_into(buffer)
+            except socket.timeout:
+                continue
+            arrival = time.monotonic()
+            if size == CONTROL_PACKET.size and self.paired:
+                self.steering, self.throttle, self.brakes, timestamp = CONTROL_PACKET.unpack_from(buffer)
+                now_ms = (time.time() - self.time_origin) * 1000 if self.time_origin is not None else None
+                self.stats.observe(timestamp, now_ms, arrival)
+            else:
+                self._handle_pair(bytes(buffer[:size]), sender)
+
+    def _outgauge_packet(self, started: float) -> bytes:
+        rpm = IDLE_RPM + self.speed * RPM_PER_SPEED
+        return OUTGAUGE_PACKET.pack(
+            round((time.monotonic() - started) * 1000) & 0xffffffff, b'sim', 0, 2, 0, self.speed, rpm, 0., 90., 0.5,
+            3., 90., 0, 0, self.throttle, self.brakes, 0., b'', b'', self.outgauge_sent & 0x7fffffff
+        )
+
+    def _outgauge_cycle(self):
+        """
+        Шлет телеметрию с фиксированной частотой и заодно продвигает модель машины
+        :return:
+        """
+        period = 1. / self.outgauge_rate
+        started = deadline = time.monotonic()
+        while self._active:
+            deadline += period
+            time.sleep(max(0., deadline - time.monotonic()))
+            acceleration = self.throttle * MAX_ACCELERATION - self.brakes * MAX_DECELERATION - self.speed * DRAG
+            self.speed = max(0., self.speed + acceleration * period)
+            if not self.paired:
+                continue
+            self._socket.sendto(self._outgauge_packet(started), (self.client_host, self.client_port))
+            self.outgauge_sent += 1
+
+    def start(self):
+        if self._active:
+            return
+        self._active = True
+        self._recv_thread = threading.Thread(target=self._recv_cycle, daemon=True)
+        self._outgauge_thread = threading.Thread(target=self._outgauge_cycle, daemon=True)
+        self._recv_thread.start()
+        self._outgauge_thread.start()
+
+    def stop(self):
+        if not self._active:
+            return
+        self._active = False
+        self._recv_thread.join()
+        self._outgauge_thread.join()
+        self._socket.close()
+
+
+def load_test(simulator: BeamNGSimulator, drive_rate: float, duration: float, event_driven: bool = True) -> Dict:
+    """
+    Подключает Controller к simulator по loopback и крутит руль по синусоиде с частотой drive_rate изменений в
+    секунду
+    :param simulator: запущенный заменитель игры
+    :param drive_rate: сколько раз в секунду меняется руль
+    :param duration: длительность теста, секунды
+    :param event_driven: режим отправки Controller
+    :return: статистика: отправлено, потеряно, перестановки, задержка и т.д.
+    """
+    from autopilot.controller import Controller
+    from autopilot.metrics import MetricsRegistry
+
+    host, port = simulator.address
+    metrics = MetricsRegistry()
+    # общее начало отсчета, что бы время отправки в пакетах было точным и задержку можно было посчитать
+    simulator.time_origin = time.time()
+    controller = Controller('load test', simulator.security_code, local_host=host, remote_host=host,
+                            event_driven=event_driven, metrics=metrics, recv_port=simulator.client_port,
+                            send_port=port, pair_address=host, time_origin=simulator.time_origin)
+    if not simulator.wait_paired(1.):
+        raise RuntimeError("Controller did not pair with the simulator")
+    controller.run()
+    period = 1. / drive_rate
+    started = deadline = time.monotonic()
+    while time.monotonic() - started < duration:
+        controller.steering = 0.5 + 0.4 * math.sin(time.monotonic() - started)
+        deadline += period
+        time.sleep(max(0., deadline - time.monotonic()))
+    controller.stop()
+    time.sleep(0.2)  # даем дойти последним пакетам
+    del controller  # закрывает сокет
+
+    counters = metrics.snapshot()
+    sent = counters['controller.sent']
+    result = simulator.stats.snapshot()
+    result.update({
+        'sent': sent,
+        'lost': simulator.stats.lost(sent),
+        'send_errors': counters.get('controller.send_errors', 0),
+        'telemetry_sent': simulator.outgauge_sent,
+        'telemetry_received': counters.get('controller.received', 0),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local BeamNG remote control stand-in")
+    parser.add_argument('--code', type=int, required=True, help="security code the client must send")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=SEND_PORT, help="pairing and control port")
+    parser.add_argument('--client-port', type=int, default=RECV_PORT, help="client telemetry port")
+    parser.add_argument('--rate', type=float, default=OUTGAUGE_RATE, help="OutGauge packets per second")
+    parser.add_argument('--drive', type=float, help="run a built-in Controller changing steering this many times "
+                                                    "per second and report the results")
+    parser.add_argument('--polling', action='store_true', help="use the polling send mode in the built-in client")
+    parser.add_argument('--duration', type=float, default=10., help="load test duration, seconds")
+    parser.add_argument('--time-origin', type=float,
+                        help="time.time() the client counts control timestamps from (its Controller time_origin); "
+                             "enables latency measurement for an external client")
+    args = parser.parse_args()
+
+    simulator = BeamNGSimulator(args.code, args.host, args.port, args.client_port, args.rate, args.time_origin)
+    simulator.start()
+    try:
+        if args.drive:
+            result = load_test(simulator, args.drive, args.duration, not args.polling)
+            for name, value in sorted(result.items()):
+                print('{} {:.6g}'.format(name, value))
+            return
+        print("Waiting for a client on {}:{}".format(*simulator.address))
+        while True:
+            time.sleep(1)
+            print("paired={} received={} reordered={} steering={:.3f} throttle={:.2f} brakes={:.2f} speed={:.1f}"
+                  .format(simulator.paired, simulator.stats.received, simulator.stats.reordered,
+                          simulator.steering, simulator.throttle, simulator.brakes, simulator.speed), end='')
+            if simulator.time_origin is not None:  # без time_origin клиента задержка не считается
+                print(" latency_p50={:.3f}ms".format(simulator.stats.latency.percentile(50) * 1000), end='')
+            print()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+from typing import Iterator, Sequence, Tuple
+
+
+class SlidingWindow:
+    """
+    Скользящее окно из последних size наборов по width чисел. Память выделяется один раз, суммы по каждой колонке
+    поддерживаются на ходу, поэтому добавление, удаление старейшего и среднее стоят O(1) независимо от размера окна
+    """
+    def __init__(self, size: int, width: int = 1):
+        """
+
+        :param size: сколько последних наборов хранить
+        :param width: сколько чисел в одном наборе
+        """
+        self.size = size
+        self.width = width
+        self._values = [(0,) * width] * size
+        self._sums = [0] * width
+        self._start = 0  # индекс старейшего набора
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self) -> Iterator[Tuple]:
+        """
+        Наборы от старейшего к новейшему
+        :return:
+        """
+        for i in range(self._count):
+            yield self._values[(self._start + i) % self.size]
+
+    def push(self, values: Sequence):
+        """
+        Добавляет набор чисел; если окно заполнено, старейший набор вытесняется
+        :param values: width чисел
+        :return:
+        """
+        if self._count == self.size:
+            self.drop_oldest()
+        index = (self._start + self._count) % self.size
+        values = tuple(values)
+        self._values[index] = values
+        sums = self._sums
+        for i in range(self.width):
+            sums[i] += values[i]
+        self._count += 1
+        if index == self.size - 1 and self._count == self.size:
+            # раз в оборот пересчитываем суммы целиком, что бы у float-ов не накапливалась погрешность вычитаний;
+            # в среднем это все равно O(1) на добавление
+            self._sums = [sum(column) for column in zip(*self._values)]
+
+    def drop_oldest(self):
+        """
+        Удаляет старейший набор, если он есть
+        :return:
+        """
+        if not self._count:
+            return
+        oldest = self._values[self._start]
+        sums = self._sums
+        for i in range(self.width):
+            sums[i] -= oldest[i]
+        self._start = (self._start + 1) % self.size
+        self._count -= 1
+
+    def clear(self):
+        self._sums = [0] * self.width
+        self._start = 0
+        self._count = 0
+
+    @property
+    def oldest(self) -> Tuple:
+        return self._values[self._start]
+
+    @property
+    def newest(self) -> Tuple:
+        return self._values[(self._start + self._count - 1) % self.size]
+
+    def mean(self) -> Tuple[float, ...]:
+        """
+        Среднее по каждой колонке
+        :return:
+        """
+        return tuple(s / self._count for s in self._sums)
+
+    def floor_mean(self) -> Tuple[int, ...]:
+        """
+        Среднее по каждой колонке, округленное вниз; для целых чисел считается точно, без float-а
+        :return:
+        """
+        return tuple(s // self._count for s in self._sums)
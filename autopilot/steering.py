@@ -0,0 +1,156 @@
+import threading
+import time
+from typing import Optional
+
+from autopilot.controller import Controller
+from autopilot.metrics import NULL_METRICS
+from autopilot.smoothing import SlidingWindow
+from autopilot.tracing import NULL_TRACER
+
+DELTA_SLIDING_WINDOW_SIZE = 5  # интервал усреднения отклонения от центра полосы
+STEERING_DELTA_SCALE = 600  # во сколько раз отклонение в пикселях больше поворота руля
+STEERING_RATE = 60.  # сколько раз в секунду обновляется руль
+MAX_EXTRAPOLATION = 0.2  # дальше скольких секунд после последнего кадра отклонение не экстраполируется
+
+
+class SteeringController:
+    """
+    Поворачивает руль с фиксированной частотой, независимо от того, как часто приходят результаты поиска линий.
+    Отклонения от центра полосы усредняются в скользящем окне вместе со временем захвата кадров; между кадрами
+    отклонение экстраполируется по наклону прямой, приближающей точки окна, так что руль поворачивается плавно и
+    вовремя даже при просадках и рывках частоты кадров. Кадры без полосы входят в среднее нулем, как и раньше, но
+    пока такой кадр есть в окне, наклон не считается: нули - не измерения, и прямая через них уводила бы руль за
+    пределы его хода
+    """
+    def __init__(self, controller: Controller, rate: float = STEERING_RATE, window: int = DELTA_SLIDING_WINDOW_SIZE,
+                 delta_scale: float = STEERING_DELTA_SCALE, extrapolate: bool = True,
+                 max_extrapolation: float = MAX_EXTRAPOLATION, metrics=NULL_METRICS, tracer=NULL_TRACER):
+        """
+
+        :param controller: управление автомобилем
+        :param rate: частота обновления руля, раз в секунду
+        :param window: интервал усреднения отклонения, кадров
+        :param delta_scale: во сколько раз отклонение в пикселях больше поворота руля
+        :param extrapolate: экстраполировать ли отклонение между кадрами; без этого руль держит среднее по окну
+        :param max_extrapolation: на сколько секунд после захвата последнего кадра допускается экстраполяция
+        :param metrics: autopilot.metrics.MetricsRegistry для опозданий тактов и возраста данных
+        :param tracer: autopilot.tracing.Tracer; первый такт после нового кадра ставит отметку smoothed
+        """
+        self.controller = controller
+        self.period = 1. / rate
+        self.delta_scale = delta_scale
+        self.extrapolate = extrapolate
+        self.max_extrapolation = max_extrapolation
+
+        self._window = SlidingWindow(window, 3)  # (отклонение, время захвата кадра, 1 - полоса не найдена)
+        self._lost = True  # на последнем кадре полоса не найдена
+        self._frame_id = -1  # номер последнего учтенного кадра
+        self._smoothed_frame = -1  # номер последнего кадра, уже попавшего в такт руля
+        self._lock = threading.Lock()
+        self.tracer = tracer
+
+        self._lateness_metric = metrics.histogram('steering.lateness')
+        self._age_metric = metrics.histogram('steering.data_age')
+
+        self._active = False
+        self._thread = None
+
+    def update(self, delta: Optional[float], timestamp: float, frame_id: int = -1):
+        """
+        Учитывает результат поиска линий на очередном кадре
+        :param delta: отклонение от центра полосы или None, если полоса не найдена
+        :param timestamp: время захвата кадра по time.monotonic()
+        :param frame_id: номер кадра, для трассировки
+        :return:
+        """
+        with self._lock:
+            # предыдущий кадр вытесняется, так и не попав ни в один такт руля
+            superseded = self._frame_id if self._frame_id >= 0 and self._frame_id != self._smoothed_frame else -1
+            self._window.push((0, timestamp, 1) if delta is None else (delta, timestamp, 0))
+            self._lost = delta is None
+            self._frame_id = frame_id
+        if superseded >= 0:
+            self.tracer.superseded(superseded)
+
+    def reset(self):
+        with self._lock:
+            self._window.clear()
+            self._lost = True
+            self._frame_id = self._smoothed_frame = -1
+
+    def delta_at(self, now: float) -> Optional[float]:
+        """
+        Сглаженное отклонение от центра полосы на момент now
+        :param now: время по time.monotonic()
+        :return: отклонение или None, если полоса сейчас не найдена
+        """
+        with self._lock:
+            if self._lost:
+                return None
+            window = self._window
+            delta, center_time, lost = window.mean()
+            if not self.extrapolate or len(window) < 2 or lost:
+                return delta
+            # наклон прямой, приближающей все точки окна методом наименьших квадратов; она проходит через среднее
+            # окна в среднее время его кадров, от него прямую и продолжаем
+            covariance = variance = 0.
+            for d, t, _ in window:
+                covariance += (t - center_time) * (d - delta)
+                variance += (t - center_time) ** 2
+            if variance <= 0:
+                return delta
+            last_time = window.newest[1]
+            return delta + covariance / variance * (min(now, last_time + self.max_extrapolation) - center_time)
+
+    def steering_at(self, now: float) -> float:
+        """
+        Положение руля на момент now
+        :param now: время по time.monotonic()
+        :return: положение руля, 0..1
+        """
+        delta = self.delta_at(now)
+        if delta is None:
+            return 0.5
+        return min(1., max(0., 0.5 + delta / self.delta_scale))
+
+    def _steering_cycle(self):
+        deadline = time.monotonic()
+        while self._active:
+            now = time.monotonic()
+            self._lateness_metric.observe(now - deadline)
+            with self._lock:  # до расчета: кадр, пришедший во время расчета, в руль может не попасть
+                frame_id, fresh = self._frame_id, self._frame_id != self._smoothed_frame
+                self._smoothed_frame = frame_id
+            steering = self.steering_at(now)
+            if fresh:
+                self.tracer.mark(frame_id, 'smoothed', now)
+            self.controller.steering_frame = frame_id  # до руля: событийная отправка может уйти сразу
+            self.controller.steering = steering
+            if len(self._window):
+                self._age_metric.observe(now - self._window.newest[1])
+
+            deadline += self.period
+            now = time.monotonic()
+            if deadline < now:  # проспали такт(ы) - не пытаемся догнать, а считаем от текущего момента
+                deadline = now
+            else:
+                time.sleep(deadline - now)
+
+    def start(self):
+        if self._active:
+            return
+        self.reset()
+        self._active = True
+        self._thread = threading.Thread(target=self._steering_cycle, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Останавливает обновление руля и возвращает его в центр
+        :return:
+        """
+        if not self._active:
+            return
+        self._active = False
+        self._thread.join()
+        self.controller.steering = 0.5
@@ -0,0 +1,305 @@
+"""
+Несколько независимых автопилотов одновременно (несколько экземпляров игры или несколько видов с камер). Каждый
+экземпляр - свой процесс со своим захватом, Seeker-ом, Controller-ом и портами, закрепленный за своими ядрами, так
+что поиск линий разных экземпляров не делит один интерпретатор. Кадры с нарисованными данными каждый процесс пишет
+в свой блок общей памяти, а окна просмотра показывают их из отдельных процессов.
+
+    python -m autopilot.supervisor instances.json
+
+Формат файла настроек:
+
+    {
+        "preview_rate": 15,
+        "instances": [
+            {"name": "left", "cropbox": [0, 0, 1720, 1080], "monitor": 1, "remote_host": "192.168.1.8",
+             "recv_port": 4445, "send_port": 4444, "security_code": 46611, "cpus": [0, 1]},
+            {"name": "right", "cropbox": [0, 0, 1720, 1080], "monitor": 2, "remote_host": "192.168.1.9",
+             "recv_port": 4447, "send_port": 4444, "security_code": 46612,
+             "roi": [0.22, 0.8, 0.4, 0.55, 0.6, 0.55, 0.78, 0.8], "seeker": {"threshold": 20}}
+        ]
+    }
+"""
+import argparse
+import json
+import multiprocessing
+import os
+from typing import Dict, List, Optional, Sequence
+
+from autopilot.controller import RECV_PORT, SEND_PORT
+from autopilot.preview import PREVIEW_RATE, FrameViewer, SharedFrame
+from autopilot.seeker import Point
+from autopilot.steering import STEERING_RATE
+
+DEFAULT_ROI = (0.22, 0.8, 0.4, 0.55, 0.6, 0.55, 0.78, 0.8)
+# закрепление за ядрами есть только в Linux; на Windows и macOS ядра экземпляра лишь ограничивают потоки OpenCV
+CAN_PIN_CPUS = hasattr(os, 'sched_setaffinity')
+
+
+class InstanceConfig:
+    """
+    Настройки одного автопилота
+    """
+    def __init__(self, name: str, cropbox: List[Point], monitor: int = 2, roi: Sequence[float] = DEFAULT_ROI,
+                 client_name: str = 'autopilot', security_code: int = 0, local_host: str = '192.168.1.5',
+                 remote_host: str = '192.168.1.8', recv_port: int = RECV_PORT, send_port: int = SEND_PORT,
+                 cpus: Optional[Sequence[int]] = None, seeker: Optional[Dict] = None,
+                 steering_rate: float = STEERING_RATE, record_path: Optional[str] = None, preview: bool = True,
+                 metrics_port: Optional[int] = None, trace_path: Optional[str] = None):
+        """
+
+        :param name: имя экземпляра, для заголовка окна и сообщений
+        :param cropbox: область экрана для захвата
+        :param monitor: номер монитора в терминах mss
+        :param roi: зона интереса, как в Seeker
+        :param client_name: название клиента при сопряжении с игрой
+        :param security_code: код безопасности игры
+        :param local_host: адрес этого компьютера
+        :param remote_host: адрес компьютера с игрой
+        :param recv_port: локальный порт телеметрии, у каждого экземпляра свой
+        :param send_port: порт игры для управления
+        :param cpus: номера ядер, за которыми закрепляется процесс (только в Linux, см. CAN_PIN_CPUS; иначе по их
+            количеству ограничиваются потоки OpenCV); None - поделить доступные ядра поровну
+        :param seeker: дополнительные параметры Seeker (rho, threshold, tracking, frame_budget...); roi, если
+            задан и здесь, заменяет отдельный roi
+        :param steering_rate: частота обновления руля, раз в секунду
+        :param record_path: путь к файлу .aprec для записи поездки
+        :param preview: показывать ли окно просмотра
+        :param metrics_port: порт MetricsServer этого экземпляра; None - без сервера метрик
+        :param trace_path: путь к файлу .npy для записей сквозной задержки кадров (autopilot.tracing)
+        """
+        self.name = name
+        self.cropbox = cropbox
+        self.monitor = monitor
+        self.roi = tuple(roi)
+        self.client_name = client_name
+        self.security_code = security_code
+        self.local_host = local_host
+        self.remote_host = remote_host
+        self.recv_port = recv_port
+        self.send_port = send_port
+        self.cpus = list(cpus) if cpus is not None else None
+        self.seeker = dict(seeker or {})
+        self.steering_rate = steering_rate
+        self.record_path = record_path
+        self.preview = preview
+        self.metrics_port = metrics_port
+        self.trace_path = trace_path
+
+    @property
+    def frame_shape(self):
+        size = self.cropbox[1] - self.cropbox[0]
+        return size.y, size.x, 4  # ScreenGrabber отдает BGRA
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'InstanceConfig':
+        """
+        Настройки из словаря (например, из JSON); cropbox задается списком x1, y1, x2, y2
+        :param data:
+        :return:
+        """
+        data = dict(data)
+        x1, y1, x2, y2 = data.pop('cropbox')
+        return cls(cropbox=[Point(x1, y1), Point(x2, y2)], **data)
+
+
+def assign_cpus(configs: List[InstanceConfig], available: Optional[Sequence[int]] = None):
+    """
+    Делит доступные ядра поровну между экземплярами, у которых ядра не заданы явно. Ядра, занятые явно, в раздел
+    не попадают, если остается хотя бы по одному ядру на экземпляр
+    :param configs:
+    :param available: номера доступных ядер; по умолчанию ядра, на которых разрешено работать этому процессу (без
+        sched_getaffinity - все ядра)
+    :return:
+    """
+    if available is None:
+        available = os.sched_getaffinity(0) if CAN_PIN_CPUS else range(os.cpu_count() or 1)
+    available = sorted(available)
+    pending = [c for c in configs if c.cpus is None]
+    if not pending:
+        return
+    taken = {cpu for c in configs if c.cpus is not None for cpu in c.cpus}
+    free = [cpu for cpu in available if cpu not in taken]
+    if len(free) < len(pending):
+        free = available
+    share = max(1, len(free) // len(pending))
+    for i, config in enumerate(pending):
+        start = i * share % len(free)
+        config.cpus = free[start:start + share]
+
+
+def run_instance(config: InstanceConfig, stop_event, frame_name: Optional[str] = None,
+                 preview_rate: float = PREVIEW_RATE):
+    """
+    Тело процесса одного автопилота: работает, пока не установлен stop_event
+    :param config:
+    :param stop_event: multiprocessing.Event остановки
+    :param frame_name: имя SharedFrame для кадров с данными; None - без просмотра
+    :param preview_rate: максимальная частота публикации кадров для просмотра
+    :return:
+    """
+    # все импорты тяжелых модулей внутри процесса экземпляра, после закрепления за ядрами
+    if config.cpus and CAN_PIN_CPUS:
+        os.sched_setaffinity(0, config.cpus)
+    import cv2
+    if config.cpus:
+        cv2.setNumThreads(len(config.cpus))  # внутренние потоки OpenCV не должны выходить за свои ядра
+
+    from autopilot.capture import ScreenGrabber
+    from autopilot.controller import Controller
+    from autopilot.metrics import MetricsRegistry, MetricsServer
+    from autopilot.pipeline import Pipeline
+    from autopilot.preview import FramePublisher
+    from autopilot.recorder import BackgroundRecorder, Recorder
+    from autopilot.seeker import Seeker
+    from autopilot.tracing import Tracer
+
+    metrics = MetricsRegistry()
+    tracer = Tracer(metrics, keep=config.trace_path is not None)
+    metrics_server = None
+    if config.metrics_port is not None:
+        metrics_server = MetricsServer(metrics, port=config.metrics_port)
+        metrics_server.start()
+
+    grabber = ScreenGrabber(config.cropbox, monitor=config.monitor)
+    seeker_kwargs = {'roi': config.roi}
+    seeker_kwargs.update(config.seeker)  # например, элемент фронта из autopilot.tuning, вместе с зоной интереса
+    seeker = Seeker([Point(0, 0), grabber.size], metrics=metrics, **seeker_kwargs)
+    controller = Controller(config.client_name, config.security_code, local_host=config.local_host,
+                            remote_host=config.remote_host, event_driven=True, metrics=metrics,
+                            recv_port=config.recv_port, send_port=config.send_port)
+    recorder = None
+    if config.record_path:
+        recorder = BackgroundRecorder(Recorder(config.record_path, grabber.size.y, grabber.size.x))
+    publisher = FramePublisher(config.frame_shape, preview_rate, name=frame_name) if frame_name else None
+    pipeline = Pipeline(grabber, seeker, controller, recorder=recorder, steering_rate=config.steering_rate,
+                        metrics=metrics, preview_window=publisher, tracer=tracer)
+    pipeline.start()
+    try:
+        while not stop_event.is_set():
+            try:
+                if pipeline.failed.wait(0.2):
+                    # процесс завершается с ошибкой, и супервизор останавливает остальные экземпляры
+                    raise pipeline.error
+            except KeyboardInterrupt:  # Ctrl+C приходит всей группе процессов, останавливаемся по команде супервизора
+                continue
+    finally:
+        pipeline.stop()
+        seeker.close()
+        if recorder is not None:
+            recorder.close()
+        if config.trace_path is not None:
+            tracer.save(config.trace_path)
+        if metrics_server is not None:
+            metrics_server.stop()
+
+
+class Supervisor:
+    """
+    Запускает по процессу на каждый автопилот и окна просмотра к ним, останавливает все по клавише выхода в любом
+    окне, Ctrl+C или падению любого из экземпляров
+    """
+    def __init__(self, configs: List[InstanceConfig], preview_rate: float = PREVIEW_RATE):
+        """
+
+        :param configs: настройки экземпляров
+        :param preview_rate: частота обновления окон просмотра
+        """
+        names = [c.name for c in configs]
+        if len(set(names)) != len(names):
+            raise ValueError("Instance names must be unique")
+        ports = [(c.local_host, c.recv_port) for c in configs]
+        if len(set(ports)) != len(ports):
+            raise ValueError("Instances on the same local host need different recv_port")
+        self.configs = configs
+        self.preview_rate = preview_rate
+
+        self._context = multiprocessing.get_context('spawn')
+        self._stop = self._context.Event()
+        self.quit_requested = self._context.Event()  # общий для всех окон
+        self._processes = []
+        self._frames: List[SharedFrame] = []
+        self._viewers: List[FrameViewer] = []
+
+    def start(self):
+        if self._processes:
+            return
+        assign_cpus(self.configs)
+        self._stop.clear()
+        self.quit_requested.clear()
+        for config in self.configs:
+            frame_name = None
+            if config.preview:
+                shared = SharedFrame(config.frame_shape)
+                self._frames.append(shared)
+                frame_name = shared.name
+                viewer = FrameViewer(frame_name, config.frame_shape, self.preview_rate, title=config.name,
+                                     quit_event=self.quit_requested)
+                self._viewers.append(viewer)
+            process = self._context.Process(target=run_instance, name='autopilot-' + config.name,
+                                            args=(config, self._stop, frame_name, self.preview_rate))
+            process.start()
+            self._processes.append(process)
+        for viewer in self._viewers:
+            viewer.start()
+
+    def wait(self, poll_interval: float = 0.2):
+        """
+        Ждет, пока в каком-нибудь окне не нажмут клавишу выхода или один из экземпляров не завершится
+        :param poll_interval:
+        :return:
+        """
+        while not self.quit_requested.wait(poll_interval):
+            dead = [p for p in self._processes if not p.is_alive()]
+            if dead:
+                print("Instance {} exited with code {}".format(dead[0].name, dead[0].exitcode))
+                return
+
+    def stop(self, timeout: float = 5.):
+        """
+        Останавливает экземпляры, окна и освобождает общую память
+        :param timeout: сколько ждать каждый процесс, прежде чем завершить его принудительно
+        :return:
+        """
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        for viewer in self._viewers:
+            viewer.stop()
+        for shared in self._frames:
+            shared.close()
+        self._processes, self._viewers, self._frames = [], [], []
+
+
+def load_config(path: str):
+    """
+    Читает файл настроек
+    :param path:
+    :return: (настройки экземпляров, частота окон просмотра)
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    configs = [InstanceConfig.from_dict(item) for item in data['instances']]
+    return configs, data.get('preview_rate', PREVIEW_RATE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several autopilot instances, one process per instance")
+    parser.add_argument('config', help="JSON file with instance settings")
+    args = parser.parse_args()
+
+    configs, preview_rate = load_config(args.config)
+    supervisor = Supervisor(configs, preview_rate)
+    supervisor.start()
+    try:
+        supervisor.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import struct
+import threading
+from typing import Optional
+
+import numpy as np
+
+# Пакет OutGauge, https://github.com/BeamNG/remotecontrol
+OUTGAUGE_PACKET = struct.Struct('<I3sxH2B7f2I3f15sx15sxi')
+TELEMETRY_HISTORY = 1024  # сколько последних пакетов хранится в истории
+
+# тот же пакет OutGauge как запись NumPy: поля по их смещениям внутри пакета
+OUTGAUGE_DTYPE = np.dtype({
+    'names': ['time', 'car', 'flags', 'gear', 'plid', 'speed', 'rpm', 'turbo', 'eng_temp', 'fuel', 'oil_pressure',
+              'oil_temp', 'dash_lights', 'show_lights', 'throttle', 'brake', 'clutch', 'display1', 'display2', 'id'],
+    'formats': ['<u4', 'S3', '<u2', 'u1', 'u1', '<f4', '<f4', '<f4', '<f4', '<f4', '<f4', '<f4', '<u4', '<u4', '<f4',
+                '<f4', '<f4', 'S15', 'S15', '<i4'],
+    'offsets': [0, 4, 8, 10, 11, 12, 16, 20, 24, 28, 32, 36, 40, 44, 48, 52, 56, 60, 76, 92],
+    'itemsize': OUTGAUGE_PACKET.size,
+})
+
+# запись истории: пакет байт в байт, за ним время получения
+TIMESTAMP_OFFSET = OUTGAUGE_PACKET.size
+TIMESTAMP = struct.Struct('<d')
+HISTORY_DTYPE = np.dtype({
+    'names': list(OUTGAUGE_DTYPE.names) + ['timestamp'],
+    'formats': [OUTGAUGE_DTYPE.fields[name][0] for name in OUTGAUGE_DTYPE.names] + ['<f8'],
+    'offsets': [OUTGAUGE_DTYPE.fields[name][1] for name in OUTGAUGE_DTYPE.names] + [TIMESTAMP_OFFSET],
+    'itemsize': TIMESTAMP_OFFSET + TIMESTAMP.size,
+})
+
+
+class Telemetry:
+    """
+    Полностью разобранный пакет OutGauge
+    """
+    __slots__ = (
+        'timestamp', 'time', 'car', 'flags', 'gear', 'plid', 'speed', 'rpm', 'turbo', 'eng_temp', 'fuel',
+        'oil_pressure', 'oil_temp', 'dash_lights', 'show_lights', 'throttle', 'brake', 'clutch', 'display1',
+        'display2', 'id'
+    )
+
+    def __init__(self, timestamp: float, fields: tuple):
+        """
+
+        :param timestamp: время получения пакета по time.monotonic()
+        :param fields: результат OUTGAUGE_PACKET.unpack
+        """
+        self.timestamp = timestamp
+        (
+            self.time,  # время в мс (для пропуска устаревших пакетов)
+            self.car,  # название машины
+            self.flags,  # OG_x, битовые флаги
+            self.gear,  # передача: 0 - задняя, 1 - нейтраль, 2 - первая...
+            self.plid,  # id игрока
+            self.speed,  # скорость, м/с
+            self.rpm,  # об./мин
+            self.turbo,  # давление турбины, бар
+            self.eng_temp,  # температура двигателя, °C
+            self.fuel,  # уровень топлива, 0..1
+            self.oil_pressure,  # давление масла, бар
+            self.oil_temp,  # температура масла, °C
+            self.dash_lights,  # доступные индикаторы на приборной панели
+            self.show_lights,  # включенные индикаторы на приборной панели
+            self.throttle,  # газ, 0..1
+            self.brake,  # тормоз, 0..1
+            self.clutch,  # сцепление, 0..1
+            self.display1,  # обычно расход топлива
+            self.display2,  # обычно настройки
+            self.id,  # id пакета
+        ) = fields
+
+    def __repr__(self):
+        return "Telemetry(speed={:.2f}, rpm={:.0f}, gear={})".format(self.speed, self.rpm, self.gear)
+
+
+class TelemetryHistory:
+    """
+    Кольцевой буфер последних пакетов телеметрии, выделяется один раз. Пакет копируется в кольцо как есть, байт в
+    байт, и разбирается только при чтении: на прием пакета не создается ни кортежей, ни объектов по полям
+    """
+    def __init__(self, size: int = TELEMETRY_HISTORY):
+        self._data = np.zeros(size, dtype=HISTORY_DTYPE)
+        self._raw = memoryview(self._data.view(np.uint8))  # те же записи как байты
+        self._count = 0  # сколько всего пакетов было добавлено
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self._data.shape[0])
+
+    def append(self, packet, timestamp: float):
+        """
+        Копирует пакет в кольцо
+        :param packet: буфер с пакетом OutGauge в начале (bytes, bytearray, memoryview)
+        :param timestamp: время получения пакета по time.monotonic()
+        :return:
+        """
+        with self._lock:
+            offset = self._count % self._data.shape[0] * HISTORY_DTYPE.itemsize
+            self._raw[offset:offset + TIMESTAMP_OFFSET] = packet[:TIMESTAMP_OFFSET]
+            TIMESTAMP.pack_into(self._raw, offset + TIMESTAMP_OFFSET, timestamp)
+            self._count += 1
+
+    def latest(self) -> Optional[Telemetry]:
+        """
+        Последний пакет, полностью разобранный
+        :return: Telemetry или None, если пакетов еще не было
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            offset = (self._count - 1) % self._data.shape[0] * HISTORY_DTYPE.itemsize
+            return Telemetry(TIMESTAMP.unpack_from(self._raw, offset + TIMESTAMP_OFFSET)[0],
+                             OUTGAUGE_PACKET.unpack_from(self._raw, offset))
+
+    def latest_value(self, field: str, default=0):
+        """
+        Одно поле последнего пакета, без разбора остальных
+        :param field: имя поля HISTORY_DTYPE
+        :param default: значение, если пакетов еще не было
+        :return:
+        """
+        with self._lock:
+            if not self._count:
+                return default
+            return self._data[field][(self._count - 1) % self._data.shape[0]].item()
+
+    def snapshot(self) -> np.ndarray:
+        """
+        Копия истории в порядке получения пакетов, от старых к новым
+        :return:
+        """
+        with self._lock:
+            size = self._data.shape[0]
+            if self._count <= size:
+                return self._data[:self._count].copy()
+            start = self._count % size
+            return np.concatenate((self._data[start:], self._data[:start]))
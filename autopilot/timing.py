@@ -0,0 +1,49 @@
+import time
+from typing import Dict, List
+
+
+class StageTimer:
+    """
+    Замеряет время стадий обработки кадра. Каждая отметка lap() записывает время, прошедшее с предыдущей отметки
+    (или с вызова start())
+    """
+    def __init__(self):
+        self.stages: Dict[str, List[float]] = {}  # название стадии -> замеры в секундах
+        self._last = 0.
+
+    def start(self):
+        """
+        Начало обработки кадра
+        :return:
+        """
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        """
+        Конец стадии stage
+        :param stage: название стадии
+        :return:
+        """
+        now = time.perf_counter()
+        samples = self.stages.get(stage)
+        if samples is None:
+            samples = self.stages[stage] = []
+        samples.append(now - self._last)
+        self._last = now
+
+    def reset(self):
+        self.stages = {}
+
+
+class NullTimer:
+    """
+    Таймер, который ничего не делает. Используется по умолчанию, что бы не проверять наличие таймера на каждой стадии
+    """
+    def start(self):
+        pass
+
+    def lap(self, stage: str):
+        pass
+
+
+NULL_TIMER = NullTimer()
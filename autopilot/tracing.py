@@ -0,0 +1,198 @@
+"""
+Сквозная трассировка задержки: у каждого кадра есть запись с отметками времени (time.monotonic()) на всем пути от
+захвата до пакета управления. По завершенным записям считаются гистограммы задержек отдельных участков и всего пути,
+а по каждому отправленному пакету - возраст кадра, из которого получено положение руля. Записи можно сохранить в .npy
+для офлайн-разбора:
+
+    python -m autopilot.tracing trace.npy
+
+Отметки по порядку:
+    grab_started - начало снимка экрана;
+    captured - снимок готов (время кадра в ScreenGrabber.read());
+    dequeued - поиск линий забрал кадр;
+    detected - поиск линий закончен;
+    smoothed - руль впервые посчитан с учетом этого кадра (такт SteeringController);
+    sent - первый пакет управления с этим положением руля ушел в игру.
+
+Кадры, которые поиск линий не успел забрать, в трассировку не попадают вовсе. Кадры, которые SteeringController
+заменил следующим кадром раньше, чем до них дошел такт руля, считаются в trace.superseded. Кадр, попавший в такт, но
+не изменивший руль, может так и не получить отметку sent (событийная отправка не шлет одинаковые пакеты) - такие
+записи просто не завершаются и в гистограммы не попадают.
+"""
+import argparse
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from autopilot.metrics import NULL_METRICS, PERCENTILES
+
+TRACE_RING_SIZE = 64  # сколько незавершенных записей храним одновременно
+
+TRACE_STAGES = ('grab_started', 'captured', 'dequeued', 'detected', 'smoothed', 'sent')
+# участки пути: название, отметка начала, отметка конца
+TRACE_HOPS = (
+    ('capture', 'grab_started', 'captured'),
+    ('queue', 'captured', 'dequeued'),
+    ('detect', 'dequeued', 'detected'),
+    ('smooth', 'detected', 'smoothed'),
+    ('send', 'smoothed', 'sent'),
+    ('total', 'grab_started', 'sent'),
+)
+
+# сохраняемая запись: номер кадра и отметки времени, секунды по time.monotonic()
+TRACE_DTYPE = np.dtype([('frame', '<i8')] + [(stage, '<f8') for stage in TRACE_STAGES])
+
+_STAGE_INDEX = {stage: i + 1 for i, stage in enumerate(TRACE_STAGES)}
+_SENT = _STAGE_INDEX['sent']
+_HOP_INDICES = tuple((name, _STAGE_INDEX[begin], _STAGE_INDEX[end]) for name, begin, end in TRACE_HOPS)
+
+
+class Tracer:
+    """
+    Записи трассировки кадров в кольцевом буфере. Отметки ставят разные потоки (поиск линий, руль, отправка), поэтому
+    все операции под одной блокировкой; каждая - несколько присваиваний
+    """
+    def __init__(self, metrics=NULL_METRICS, size: int = TRACE_RING_SIZE, keep: bool = False):
+        """
+
+        :param metrics: autopilot.metrics.MetricsRegistry для гистограмм trace.*
+        :param size: размер кольцевого буфера незавершенных записей
+        :param keep: сохранять ли завершенные записи для records() и save()
+        """
+        self.keep = keep
+        self._ring = [[-1] + [0.] * len(TRACE_STAGES) for _ in range(size)]
+        self._kept = []
+        self._lock = threading.Lock()
+
+        self._hop_metrics = [(metrics.histogram('trace.' + name), begin, end) for name, begin, end in _HOP_INDICES]
+        self._age_metric = metrics.histogram('trace.frame_age_at_send')
+        self._completed_metric = metrics.counter('trace.completed')
+        self._superseded_metric = metrics.counter('trace.superseded')
+
+    def begin(self, frame_id: int, grab_started: float, captured: float, dequeued: Optional[float] = None):
+        """
+        Заводит запись кадра
+        :param frame_id: номер кадра
+        :param grab_started: начало снимка
+        :param captured: время кадра
+        :param dequeued: когда поиск линий забрал кадр; по умолчанию сейчас
+        :return:
+        """
+        if dequeued is None:
+            dequeued = time.monotonic()
+        with self._lock:
+            record = self._ring[frame_id % len(self._ring)]
+            record[0] = frame_id
+            record[1:] = grab_started, captured, dequeued, 0., 0., 0.
+
+    def mark(self, frame_id: int, stage: str, timestamp: Optional[float] = None):
+        """
+        Ставит отметку stage, если у кадра ее еще нет
+        :param frame_id: номер кадра
+        :param stage: одна из TRACE_STAGES
+        :param timestamp: время по time.monotonic(); по умолчанию сейчас
+        :return:
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        index = _STAGE_INDEX[stage]
+        with self._lock:
+            record = self._ring[frame_id % len(self._ring)]
+            if record[0] == frame_id and not record[index]:
+                record[index] = timestamp
+
+    def sent(self, frame_id: int, timestamp: Optional[float] = None):
+        """
+        Отметка отправки пакета с положением руля, посчитанным по кадру frame_id. Возраст кадра учитывается для каждого
+        пакета, а запись завершается только первым
+        :param frame_id: номер кадра
+        :param timestamp: время отправки по time.monotonic(); по умолчанию сейчас
+        :return:
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._lock:
+            record = self._ring[frame_id % len(self._ring)]
+            if record[0] != frame_id or not record[_STAGE_INDEX['smoothed']]:
+                return
+            self._age_metric.observe(timestamp - record[_STAGE_INDEX['captured']])
+            if record[_SENT]:
+                return
+            record[_SENT] = timestamp
+            for metric, begin, end in self._hop_metrics:
+                metric.observe(record[end] - record[begin])
+            self._completed_metric.inc()
+            if self.keep:
+                self._kept.append(tuple(record))
+
+    def superseded(self, frame_id: int):
+        """
+        Кадр заменен следующим кадром раньше, чем попал в такт руля, и отметки smoothed и sent не получит
+        :param frame_id: номер кадра
+        :return:
+        """
+        self._superseded_metric.inc()
+
+    def records(self) -> np.ndarray:
+        """
+        Завершенные записи (только при keep=True)
+        :return: массив TRACE_DTYPE
+        """
+        with self._lock:
+            return np.array(self._kept, dtype=TRACE_DTYPE)
+
+    def save(self, path: str):
+        np.save(path, self.records())
+
+
+class NullTracer:
+    """
+    Трассировка, которая ничего не делает. Используется по умолчанию, что бы не проверять ее наличие в горячих циклах
+    """
+    def begin(self, frame_id: int, grab_started: float, captured: float, dequeued: Optional[float] = None):
+        pass
+
+    def mark(self, frame_id: int, stage: str, timestamp: Optional[float] = None):
+        pass
+
+    def sent(self, frame_id: int, timestamp: Optional[float] = None):
+        pass
+
+    def superseded(self, frame_id: int):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+def hop_latencies(records: np.ndarray) -> dict:
+    """
+    Задержки участков пути по сохраненным записям
+    :param records: массив TRACE_DTYPE
+    :return: название участка -> массив задержек, секунды
+    """
+    return {name: records[end] - records[begin] for name, begin, end in TRACE_HOPS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a saved end-to-end latency trace")
+    parser.add_argument('path', help="trace saved by Tracer.save() (.npy)")
+    args = parser.parse_args()
+
+    records = np.load(args.path)
+    print("{} frames".format(records.shape[0]))
+    if not records.shape[0]:
+        return
+    print("{:>10}{:>10}".format('hop, ms', 'mean') + ''.join('{:>10}'.format('p{}'.format(q)) for q in PERCENTILES)
+          + '{:>10}'.format('max'))
+    for name, latency in hop_latencies(records).items():
+        latency = latency * 1000
+        print('{:>10}{:>10.3f}'.format(name, latency.mean())
+              + ''.join('{:>10.3f}'.format(np.percentile(latency, q)) for q in PERCENTILES)
+              + '{:>10.3f}'.format(latency.max()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+TRACK_ALPHA = 0.5  # коэффициент коррекции положения альфа-бета фильтра
+TRACK_BETA = 0.1  # коэффициент коррекции скорости альфа-бета фильтра
+TRACK_MAX_MISSES = 3  # после стольких кадров подряд без линии трекинг считается потерянным
+
+
+class LaneTracker:
+    """
+    Альфа-бета фильтр положения одной линии разметки. Линия задается координатами x в двух фиксированных строках
+    изображения (верх и низ зоны интереса), скорость измеряется в пикселях за кадр
+    """
+    def __init__(self, alpha: float = TRACK_ALPHA, beta: float = TRACK_BETA, max_misses: int = TRACK_MAX_MISSES):
+        """
+
+        :param alpha: коэффициент коррекции положения
+        :param beta: коэффициент коррекции скорости
+        :param max_misses: сколько кадров подряд линия может не находиться, прежде чем трекинг будет сброшен
+        """
+        self.alpha = alpha
+        self.beta = beta
+        self.max_misses = max_misses
+        self._x: Optional[np.ndarray] = None  # (x сверху, x снизу)
+        self._v = np.zeros(2)
+        self._misses = 0
+
+    @property
+    def tracked(self) -> bool:
+        return self._x is not None
+
+    def predict(self) -> Optional[Tuple[float, float]]:
+        """
+        Ожидаемое положение линии на следующем кадре
+        :return: (x сверху, x снизу) или None, если линия не отслеживается
+        """
+        if self._x is None:
+            return None
+        x_top, x_bottom = self._x + self._v
+        return x_top, x_bottom
+
+    def update(self, measurement: Optional[Tuple[float, float]]):
+        """
+        Учитывает положение линии, найденное на очередном кадре
+        :param measurement: (x сверху, x снизу) или None, если линия не найдена
+        :return:
+        """
+        if measurement is None:
+            if self._x is None:
+                return
+            self._misses += 1
+            if self._misses > self.max_misses:
+                self.reset()
+            else:
+                self._x = self._x + self._v  # идем по прогнозу
+            return
+
+        measured = np.array(measurement, dtype=np.float64)
+        self._misses = 0
+        if self._x is None:
+            self._x = measured
+            self._v = np.zeros(2)
+            return
+        predicted = self._x + self._v
+        residual = measured - predicted
+        self._x = predicted + self.alpha * residual
+        self._v = self._v + self.beta * residual
+
+    def reset(self):
+        self._x = None
+        self._v = np.zeros(2)
+        self._misses = 0
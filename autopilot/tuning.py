@@ -0,0 +1,214 @@
+"""
+Подбор параметров алгоритма Хафа и зоны интереса Seeker на записанных кадрах. Варианты настроек прогоняются в пуле
+процессов, каждый оценивается по стабильности результата и по задержке, а на выходе - фронт Парето: настройки, которые
+нельзя улучшить по одному критерию, не ухудшив другой.
+
+    python -m autopilot.tuning session.aprec -o front.json --rho 1,2 --threshold 10,15,20,30 \\
+        --min-line-length 20,40,60 --max-line-gap 10,25,40 --roi 0.22,0.8,0.4,0.55,0.6,0.55,0.78,0.8
+
+Критерии (все минимизируются):
+    latency - медиана времени detect() на кадр, мс;
+    jitter - дисперсия изменения отклонения между соседними кадрами (без разметки) или средняя абсолютная ошибка
+        отклонения относительно разметки (--labels, массив autopilot.batch.RESULT_DTYPE);
+    missed - доля кадров, на которых не найдена хотя бы одна из линий.
+
+Каждый элемент выходного JSON содержит seeker - параметры для Seeker(cropbox, **seeker) - и scores.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from autopilot.benchmark import DEFAULT_ROI, load_frames
+from autopilot.seeker import Seeker, Point
+
+OBJECTIVES = ('latency', 'jitter', 'missed')
+WARMUP_FRAMES = 5  # кадры до начала замеров задержки (ленивая инициализация OpenCV)
+
+_frames: List[np.ndarray] = []  # кадры, загруженные в процесс пула один раз
+_cropbox: List[Point] = []
+
+
+def _init_worker(path: str, limit: Optional[int], cropbox: Optional[Sequence[int]]):
+    """
+    Инициализация процесса пула: загружаем кадры и запрещаем OpenCV собственные потоки, что бы процессы не
+    мешали друг другу и задержка каждого варианта мерялась на одном ядре
+    :return:
+    """
+    global _frames, _cropbox
+    cv2.setNumThreads(1)
+    _frames = load_frames(path, limit)
+    if cropbox is None:
+        height, width = _frames[0].shape[:2]
+        _cropbox = [Point(0, 0), Point(width, height)]
+    else:
+        _cropbox = [Point(*cropbox[:2]), Point(*cropbox[2:])]
+
+
+def evaluate(seeker_kwargs: Dict, labels: Optional[np.ndarray] = None) -> Dict[str, float]:
+    """
+    Прогоняет кадры процесса через Seeker с заданными параметрами
+    :param seeker_kwargs: параметры Seeker
+    :param labels: ожидаемые отклонения по кадрам (NaN - не размечено)
+    :return: оценки по OBJECTIVES и дополнительные показатели
+    """
+    seeker = Seeker(_cropbox, **seeker_kwargs)
+    for frame in _frames[:WARMUP_FRAMES]:
+        seeker.detect(frame)
+    seeker = Seeker(_cropbox, **seeker_kwargs)  # состояние скользящих окон после разогрева не нужно
+
+    latency = np.empty(len(_frames))
+    deltas = np.full(len(_frames), np.nan)
+    both = 0
+    for index, frame in enumerate(_frames):
+        started = time.perf_counter()
+        detection = seeker.detect(frame)
+        latency[index] = time.perf_counter() - started
+        if detection.delta is not None:
+            deltas[index] = detection.delta
+        both += detection.left_line is not None and detection.right_line is not None
+    seeker.close()
+
+    if labels is not None:
+        labeled = ~np.isnan(labels[:len(deltas)])
+        found = labeled & ~np.isnan(deltas)
+        jitter = float(np.mean(np.abs(deltas[found] - labels[:len(deltas)][found]))) if found.any() else np.inf
+    else:
+        steps = np.diff(deltas)
+        steps = steps[~np.isnan(steps)]
+        jitter = float(np.var(steps)) if steps.shape[0] else np.inf
+    return {
+        'latency': float(np.median(latency) * 1000),
+        'latency_p95': float(np.percentile(latency, 95) * 1000),
+        'jitter': jitter,
+        'missed': 1 - both / len(_frames),
+        'delta_variance': float(np.nanvar(deltas)) if not np.isnan(deltas).all() else np.inf,
+    }
+
+
+def _evaluate_task(seeker_kwargs: Dict, labels: Optional[np.ndarray]) -> Dict:
+    return {'seeker': seeker_kwargs, 'scores': evaluate(seeker_kwargs, labels)}
+
+
+def dominates(a: Dict[str, float], b: Dict[str, float], objectives: Sequence[str] = OBJECTIVES) -> bool:
+    """
+    Не хуже ли a по всем критериям и лучше хотя бы по одному
+    :param a:
+    :param b:
+    :param objectives:
+    :return:
+    """
+    return all(a[o] <= b[o] for o in objectives) and any(a[o] < b[o] for o in objectives)
+
+
+def pareto_front(results: List[Dict], objectives: Sequence[str] = OBJECTIVES) -> List[Dict]:
+    """
+    Недоминируемые результаты, по возрастанию задержки
+    :param results: элементы с ключом scores
+    :param objectives:
+    :return:
+    """
+    front = [
+        r for r in results
+        if not any(dominates(other['scores'], r['scores'], objectives) for other in results if other is not r)
+    ]
+    return sorted(front, key=lambda r: r['scores']['latency'])
+
+
+def search_space(rho: Sequence[float], theta: Sequence[float], threshold: Sequence[int],
+                 min_line_length: Sequence[int], max_line_gap: Sequence[int], roi: Sequence[Sequence[float]],
+                 samples: Optional[int] = None, seed: int = 0) -> List[Dict]:
+    """
+    Все сочетания значений параметров или случайная выборка из них
+    :param rho: значения rho
+    :param theta: значения theta, радианы
+    :param threshold: значения порога
+    :param min_line_length: значения минимальной длины линии
+    :param max_line_gap: значения максимального разрыва
+    :param roi: варианты зоны интереса
+    :param samples: сколько сочетаний выбрать случайно; None - все
+    :param seed: зерно случайной выборки
+    :return: список параметров Seeker
+    """
+    grid = [
+        {'rho': r, 'theta': t, 'threshold': thr, 'min_line_length': length, 'max_line_gap': gap, 'roi': list(z)}
+        for r, t, thr, length, gap, z in itertools.product(rho, theta, threshold, min_line_length, max_line_gap, roi)
+    ]
+    if samples is not None and samples < len(grid):
+        grid = random.Random(seed).sample(grid, samples)
+    return grid
+
+
+def tune(path: str, space: List[Dict], cropbox: Optional[Sequence[int]] = None, limit: Optional[int] = None,
+         labels: Optional[np.ndarray] = None, workers: Optional[int] = None) -> List[Dict]:
+    """
+    Оценивает все варианты настроек в пуле процессов
+    :param path: запись, видео или папка с картинками
+    :param space: варианты параметров Seeker
+    :param cropbox: x1, y1, x2, y2; по умолчанию весь кадр
+    :param limit: максимальное количество кадров
+    :param labels: ожидаемые отклонения по кадрам
+    :param workers: количество процессов
+    :return: результаты по всем вариантам, в порядке space
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(path, limit, cropbox)) as pool:
+        futures = [pool.submit(_evaluate_task, kwargs, labels) for kwargs in space]
+        return [f.result() for f in futures]
+
+
+def _parse_list(cast):
+    return lambda value: [cast(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search Seeker Hough/ROI parameters and output a Pareto front")
+    parser.add_argument('path', help="directory with images, a recording or a video file")
+    parser.add_argument('-o', '--output', required=True, help="where to write the Pareto front (.json)")
+    parser.add_argument('--cropbox', type=_parse_list(int), help="x1,y1,x2,y2; whole frame by default")
+    parser.add_argument('--rho', type=_parse_list(float), default=[1, 2])
+    parser.add_argument('--theta-deg', type=_parse_list(float), default=[1.])
+    parser.add_argument('--threshold', type=_parse_list(int), default=[10, 15, 25])
+    parser.add_argument('--min-line-length', type=_parse_list(int), default=[20, 40, 60])
+    parser.add_argument('--max-line-gap', type=_parse_list(int), default=[10, 25])
+    parser.add_argument('--roi', type=_parse_list(float), action='append', help="8 ROI coefficients; repeatable")
+    parser.add_argument('--samples', type=int, help="evaluate this many random combinations instead of all")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--labels', help="expected per-frame deltas: .npy with autopilot.batch.RESULT_DTYPE")
+    parser.add_argument('--limit', type=int, help="maximum number of frames to load")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--all', action='store_true', help="write all results, not only the Pareto front")
+    args = parser.parse_args()
+
+    rois = args.roi or [DEFAULT_ROI]
+    for roi in rois:
+        if len(roi) != 8:
+            parser.error("--roi expects 8 values")
+    space = search_space(args.rho, [np.deg2rad(t) for t in args.theta_deg], args.threshold, args.min_line_length,
+                         args.max_line_gap, rois, args.samples, args.seed)
+    labels = None
+    if args.labels:
+        labels = np.load(args.labels)['delta'].astype(np.float64)
+
+    results = tune(args.path, space, args.cropbox, args.limit, labels, args.workers)
+    front = pareto_front(results)
+    with open(args.output, 'w') as f:
+        json.dump(results if args.all else front, f, indent=2)
+
+    print("{} configurations, {} on the Pareto front".format(len(results), len(front)))
+    print("{:>10}{:>12}{:>8}  seeker".format('latency', 'jitter', 'missed'))
+    for r in front:
+        scores = r['scores']
+        print("{:>10.3f}{:>12.3f}{:>8.1%}  {}".format(scores['latency'], scores['jitter'], scores['missed'],
+                                                     json.dumps(r['seeker'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,53 +1,74 @@
 from autopilot.seeker import Seeker, Point
+from autopilot.calibration import Calibration, CALIBRATION_PATH
 from autopilot.controller import Controller
-import cv2
-import numpy as np
-import mss
-import statistics
-
-delta_sliding_window_size = 5
-delta_sliding_window = []
-
-def grab_screenshot():
-    """
-    Делаем скриншот
-    :return:
-    """
-    with mss.mss() as m:
-        return np.array(m.grab(m.monitors[2]))
-
-
-cropbox = [Point(200,0), Point(1920, 1080)]
-s = Seeker(cropbox, roi=(0.22, 0.8, 0.4, 0.55, 0.6, 0.55, 0.78, 0.8))
-c = Controller("autopilot test", 46611, local_host='192.168.1.5', remote_host='192.168.1.8')
-c.run()
-
-
-while True:
-    try:
-        frame = grab_screenshot()  # получаем скриншот
-        image, delta = s.process_frame(frame, show_data=True)  # получаем кадр с данными, отклонение от середины
-        # Показываем как оно все есть
-        cv2.namedWindow('frame', cv2.WINDOW_KEEPRATIO)
-        cv2.imshow('frame', image)
-        cv2.resizeWindow('frame', int(1280), int(720))
-        # Усредняем дельту, что бы при резких изменениях ситуации руль не прыгал из стороны в сторону
-        if delta is not None:
-            if len(delta_sliding_window) == delta_sliding_window_size:
-                delta_sliding_window.pop(0)
-
-            delta_sliding_window.append(delta)
-            c.steering = 0.5 + sum(delta_sliding_window) / len(delta_sliding_window) / 600
-        else:
-            if len(delta_sliding_window) == delta_sliding_window_size:
-                delta_sliding_window.pop(0)
-
-            delta_sliding_window.append(0)
-            c.steering = 0.5
-        if cv2.waitKey(1) == ord('q'):
+from autopilot.capture import ScreenGrabber
+from autopilot.pipeline import Pipeline
+from autopilot.preview import PreviewWindow
+from autopilot.recorder import BackgroundRecorder, Recorder
+from autopilot.metrics import MetricsRegistry, MetricsServer
+from autopilot.tracing import Tracer
+
+
+record_path = None  # путь к файлу .aprec, если нужно записать поездку для офлайн-отладки
+trace_path = None  # путь к файлу .npy для записей сквозной задержки кадров (python -m autopilot.tracing)
+preview_rate = 15  # частота обновления окна просмотра, кадров в секунду
+# начало отсчета времени в пакетах управления: 0 - миллисекунды от начала эпохи, как у оригинального клиента;
+# для замера задержки на autopilot.simulator задать то же значение, что и его --time-origin
+time_origin = 0.
+
+
+def main():
+    metrics = MetricsRegistry()
+    metrics_server = MetricsServer(metrics, port=9100)  # метрики: curl http://127.0.0.1:9100/
+    metrics_server.start()
+    # гистограммы trace.* считаются всегда, записи по кадрам копятся только если их нужно сохранить
+    tracer = Tracer(metrics, keep=trace_path is not None)
+
+    # кропбокс, зона интереса и параметры Seeker с прошлого запуска
+    calibration = Calibration.load(CALIBRATION_PATH)
+    if calibration is None:  # первый запуск: сохраняем настройки по умолчанию, что бы их можно было поправить
+        calibration = Calibration(
+            [Point(200,0), Point(1920, 1080)], {'roi': (0.22, 0.8, 0.4, 0.55, 0.6, 0.55, 0.78, 0.8)}
+        )
+        calibration.save(CALIBRATION_PATH)
+    # сопряжение идет в фоне, пока готовятся захват и Seeker; руль не отправляется, пока игра не ответит
+    c = Controller("autopilot test", 46611, local_host='192.168.1.5', remote_host='192.168.1.8', event_driven=True,
+                   metrics=metrics, background_pairing=True, time_origin=time_origin)
+    grabber = ScreenGrabber(calibration.cropbox, monitor=2)  # снимаем только область кропбокса
+    # кадры от grabber-а уже обрезаны, поэтому Seeker-у отдаем кропбокс во весь кадр
+    s = Seeker([Point(0, 0), grabber.size], metrics=metrics, **calibration.seeker)
+    s.scale = calibration.scale
+    s.warm_up(draw=True)  # инициализация OpenCV и буферов до первого настоящего кадра
+    recorder = None
+    if record_path:  # файл пишется в своем потоке, поиск линий только копирует кадр
+        recorder = BackgroundRecorder(Recorder(record_path, grabber.size.y, grabber.size.x))
+    # окно просмотра живет в своем процессе и не тормозит поиск линий и руль
+    preview = PreviewWindow((grabber.size.y, grabber.size.x, 4), rate=preview_rate)
+    p = Pipeline(grabber, s, c, recorder=recorder, steering_rate=60, metrics=metrics, preview_window=preview,
+                 tracer=tracer)
+    p.start()
+
+    while True:
+        try:
+            if preview.quit_requested.wait(0.1):  # в окне нажали 'q'
+                break
+            if p.failed.is_set():  # например, захват экрана остановился с ошибкой
+                print("Pipeline stopped: {}".format(p.error))
+                break
+            if s.scale != calibration.scale:  # запоминаем установившийся масштаб на случай падения
+                calibration.scale = s.scale
+                calibration.save(CALIBRATION_PATH)
+        except KeyboardInterrupt:
             break
-    except KeyboardInterrupt:
-        break
 
-cv2.destroyAllWindows()
-del(c)
+    p.stop()
+    if recorder is not None:
+        recorder.close()
+    if trace_path is not None:
+        tracer.save(trace_path)
+    metrics_server.stop()
+    del(c)
+
+
+if __name__ == '__main__':  # процесс окна запускается через spawn и заново импортирует этот модуль
+    main()
@@ -0,0 +1,139 @@
+"""
+Векторизованные классификация сегментов и усреднение линий должны давать те же линии, что и исходная реализация на
+statistics.mean и объектах Line (она повторена здесь как эталон)
+"""
+import random
+import statistics
+
+import numpy as np
+import pytest
+
+from autopilot.seeker import SLIDING_LINE_WINDOW, Line, Point, Seeker
+
+WIDTH, HEIGHT = 640, 360
+
+
+class ReferenceAveraging:
+    """
+    Классификация и усреднение линий до векторизации
+    """
+    def __init__(self):
+        self._left_sliding_line = []
+        self._right_sliding_line = []
+
+    @staticmethod
+    def _average_line(line_list):
+        return Line(
+            statistics.mean([l.x1 for l in line_list]),
+            statistics.mean([l.y1 for l in line_list]),
+            statistics.mean([l.x2 for l in line_list]),
+            statistics.mean([l.y2 for l in line_list])
+        )
+
+    def _calc_average_line(self, xs, ys, is_left):
+        try:
+            mean_x = statistics.mean(xs)
+            mean_y = statistics.mean(ys)
+            xs_gt_mean = list(filter(lambda x: x > mean_x, xs))
+            ys_gt_mean = list(filter(lambda y: y > mean_y, ys))
+            xs_lt_mean = list(filter(lambda x: x < mean_x, xs))
+            ys_lt_mean = list(filter(lambda y: y < mean_y, ys))
+            if is_left:
+                if len(self._left_sliding_line) == SLIDING_LINE_WINDOW:
+                    self._left_sliding_line.pop(0)
+                self._left_sliding_line.append(Line(statistics.mean(xs_gt_mean), statistics.mean(ys_lt_mean),
+                                                    statistics.mean(xs_lt_mean), statistics.mean(ys_gt_mean)))
+                return self._average_line(self._left_sliding_line)
+            if len(self._right_sliding_line) == SLIDING_LINE_WINDOW:
+                self._right_sliding_line.pop(0)
+            self._right_sliding_line.append(Line(statistics.mean(xs_lt_mean), statistics.mean(ys_lt_mean),
+                                                 statistics.mean(xs_gt_mean), statistics.mean(ys_gt_mean)))
+            return self._average_line(self._right_sliding_line)
+        except statistics.StatisticsError:
+            return None
+
+    def lines(self, lines):
+        left_lines, right_lines = [], []
+        for line in lines:
+            _l = Line(*line[0])
+            if abs(_l.slope) > 0.55:
+                center = WIDTH / 2
+                if _l.slope > 0:
+                    if _l.x1 > center and _l.x2 > center:
+                        right_lines.append(_l)
+                elif _l.x1 < center and _l.x2 < center:
+                    left_lines.append(_l)
+        left_line = right_line = None
+        if left_lines:
+            left_line = self._calc_average_line([l.x1 for l in left_lines] + [l.x2 for l in left_lines],
+                                                [l.y1 for l in left_lines] + [l.y2 for l in left_lines], True)
+        if right_lines:
+            right_line = self._calc_average_line([l.x1 for l in right_lines] + [l.x2 for l in right_lines],
+                                                 [l.y1 for l in right_lines] + [l.y2 for l in right_lines], False)
+        return left_line, right_line
+
+
+def vectorized_lines(seeker: Seeker, lines):
+    """
+    Та же последовательность шагов, что и в Seeker._find_lines после алгоритма Хафа
+    """
+    left_segments, right_segments = seeker._classify_segments(lines)
+    left_line = seeker._calc_average_line(left_segments, True) if left_segments.shape[0] else None
+    right_line = seeker._calc_average_line(right_segments, False) if right_segments.shape[0] else None
+    return left_line, right_line
+
+
+def hough_like(rng: random.Random):
+    """
+    Сегменты в формате cv2.HoughLinesP: наклонные линии с обеих сторон, горизонтальные, вертикальные, пересекающие
+    центр и вырожденные наборы, на которых одна из половин относительно среднего пуста
+    """
+    kind = rng.random()
+    if kind < 0.1:  # одинаковые сегменты: ни одно значение не больше среднего
+        segment = [rng.randrange(WIDTH // 2), rng.randrange(HEIGHT), rng.randrange(WIDTH // 2), rng.randrange(HEIGHT)]
+        segments = [segment] * rng.randint(1, 3)
+    else:
+        segments = []
+        for _ in range(rng.randint(1, 30)):
+            x1, y1 = rng.randrange(WIDTH), rng.randrange(HEIGHT)
+            if rng.random() < 0.1:
+                x2, y2 = x1, rng.randrange(HEIGHT)  # вертикальный
+            else:
+                x2, y2 = rng.randrange(WIDTH), rng.randrange(HEIGHT)
+            segments.append([x1, y1, x2, y2])
+    return np.array(segments, dtype=np.int32).reshape(-1, 1, 4)
+
+
+def as_tuple(line):
+    return None if line is None else (line.x1, line.y1, line.x2, line.y2)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_lines_match_statistics_reference(seed):
+    rng = random.Random(seed)
+    seeker = Seeker([Point(0, 0), Point(WIDTH, HEIGHT)])
+    reference = ReferenceAveraging()
+    for frame in range(300):
+        lines = hough_like(rng)
+        expected = tuple(map(as_tuple, reference.lines(lines)))
+        assert tuple(map(as_tuple, vectorized_lines(seeker, lines))) == expected, "frame {}".format(frame)
+    seeker.close()
+
+
+def test_classification_orders_segment_ends_like_line():
+    seeker = Seeker([Point(0, 0), Point(WIDTH, HEIGHT)])
+    lines = np.array([[[100, 200, 50, 300]], [[500, 100, 600, 300]], [[10, 10, 300, 20]]], dtype=np.int32)
+    left, right = seeker._classify_segments(lines)
+    assert left.tolist() == [[50, 300, 100, 200]]
+    assert right.tolist() == [[500, 100, 600, 300]]
+    seeker.close()
+
+
+def test_parallel_halves_count_each_segment_once():
+    seeker = Seeker([Point(0, 0), Point(WIDTH, HEIGHT)], parallel=True)
+    # обе половины видят одни и те же сегменты, как если бы они попали в запас прямоугольника за центром
+    lines = np.array([[[100, 300, 150, 200]], [[318, 300, 330, 200]], [[500, 200, 550, 300]]], dtype=np.int32)
+    seeker._find_segments = lambda image, box, mask, timer=None: lines.copy()
+    detection = seeker.detect(np.zeros((HEIGHT, WIDTH, 4), dtype=np.uint8))
+    assert detection.segments == lines.shape[0]
+    seeker.close()
@@ -0,0 +1,55 @@
+import pytest
+
+from autopilot.smoothing import SlidingWindow
+
+
+def test_push_evicts_oldest_when_full():
+    window = SlidingWindow(3, 2)
+    for i in range(5):
+        window.push((i, 10 * i))
+    assert len(window) == 3
+    assert list(window) == [(2, 20), (3, 30), (4, 40)]
+    assert window.oldest == (2, 20)
+    assert window.newest == (4, 40)
+    assert window.mean() == pytest.approx((3, 30))
+
+
+def test_drop_oldest():
+    window = SlidingWindow(3)
+    window.drop_oldest()  # пустое окно - ничего не происходит
+    assert len(window) == 0
+    for i in (1, 2, 3):
+        window.push((i,))
+    window.drop_oldest()
+    assert list(window) == [(2,), (3,)]
+    assert window.mean() == pytest.approx((2.5,))
+    window.push((7,))
+    assert list(window) == [(2,), (3,), (7,)]
+    assert window.mean() == pytest.approx((4,))
+
+
+def test_floor_mean_is_exact_for_integers():
+    window = SlidingWindow(5, 4)
+    lines = [(101, 2, 303, 404), (100, 3, 300, 401), (99, 5, 301, 400)]
+    for line in lines:
+        window.push(line)
+    assert window.floor_mean() == tuple(sum(column) // len(lines) for column in zip(*lines))
+    assert all(isinstance(value, int) for value in window.floor_mean())
+
+
+def test_clear():
+    window = SlidingWindow(3)
+    window.push((5,))
+    window.clear()
+    assert len(window) == 0
+    window.push((1,))
+    assert window.mean() == (1.,)
+
+
+def test_float_sums_do_not_drift():
+    window = SlidingWindow(5)
+    for i in range(10000):
+        window.push((1e6 if i % 2 else 1e-3,))
+    for value in (0.1, 0.2, 0.3, 0.4, 0.5):
+        window.push((value,))
+    assert window.mean()[0] == pytest.approx(0.3, abs=1e-12)
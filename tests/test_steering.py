@@ -0,0 +1,106 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from autopilot.metrics import MetricsRegistry
+from autopilot.steering import SteeringController
+from autopilot.tracing import Tracer
+
+FRAME = 1 / 30
+
+
+def steering(window=5, **kwargs) -> SteeringController:
+    return SteeringController(controller=None, window=window, delta_scale=600, **kwargs)
+
+
+def test_lost_frames_do_not_drive_extrapolation():
+    # полоса потеряна на четырех кадрах и нашлась на пятом: как и без экстраполяции, среднее с нулями, 0.5 + 40 / 600
+    s = steering()
+    for i in range(4):
+        s.update(None, i * FRAME)
+    s.update(200, 4 * FRAME)
+    expected = 0.5 + 200 / 5 / 600
+    assert s.steering_at(4 * FRAME) == pytest.approx(expected)
+    assert s.steering_at(4 * FRAME + 0.2) == pytest.approx(expected)
+
+
+def test_extrapolation_resumes_when_lost_frames_leave_the_window():
+    s = steering()
+    s.update(None, 0.)
+    for i in range(1, 6):
+        s.update(10 * i, i * FRAME)
+    # окно - пять кадров с линейным ростом, прямая продолжается точно
+    assert s.delta_at(5 * FRAME + 0.1) == pytest.approx(10 * (5 + 3))
+
+
+def test_slope_fits_all_points():
+    s = steering()
+    for i, delta in enumerate((0, 10, 20, 30, 20)):
+        s.update(delta, i * FRAME)
+    # по крайним точкам наклон был бы 150 пикселей в секунду, по всем точкам - 180
+    slope = (-2 * 0 - 10 + 0 + 30 + 2 * 20) / (10 * FRAME)
+    assert s.delta_at(4 * FRAME) == pytest.approx(16 + slope * 2 * FRAME)
+
+
+def test_extrapolation_is_limited_in_time():
+    s = steering(max_extrapolation=0.1)
+    for i in range(5):
+        s.update(10 * i, i * FRAME)
+    assert s.delta_at(4 * FRAME + 1.) == pytest.approx(s.delta_at(4 * FRAME + 0.1))
+
+
+def test_steering_is_clamped():
+    s = steering()
+    for i in range(5):
+        s.update(300 * i, i * FRAME)
+    assert s.steering_at(4 * FRAME + 0.2) == 1.
+    s.reset()
+    for i in range(5):
+        s.update(-300 * i, i * FRAME)
+    assert s.steering_at(4 * FRAME + 0.2) == 0.
+
+
+def test_lost_lane_centers_steering():
+    s = steering()
+    for i in range(4):
+        s.update(50, i * FRAME)
+    s.update(None, 4 * FRAME)
+    assert s.delta_at(4 * FRAME) is None
+    assert s.steering_at(4 * FRAME) == 0.5
+
+
+def test_without_extrapolation_returns_window_mean():
+    s = steering(extrapolate=False)
+    for i, delta in enumerate((10, 20, 30)):
+        s.update(delta, i * FRAME)
+    assert s.delta_at(10.) == pytest.approx(20)
+
+
+def test_frames_replaced_before_a_tick_are_superseded():
+    registry = MetricsRegistry()
+    s = steering(tracer=Tracer(registry))
+    for i in range(4):
+        s.update(10, i * FRAME, frame_id=i + 1)
+    # кадры 1-3 заменены следующими без единого такта, кадр 4 еще ждет такта
+    assert registry.counters()['trace.superseded'] == 3
+    s.reset()
+    s.update(10, 0., frame_id=10)
+    assert registry.counters()['trace.superseded'] == 3
+
+
+def test_frames_used_by_a_tick_are_not_superseded():
+    registry = MetricsRegistry()
+    controller = SimpleNamespace(steering=0.5, steering_frame=-1)
+    s = SteeringController(controller=controller, rate=1000, delta_scale=600, tracer=Tracer(registry))
+    s.start()
+    try:
+        for frame_id in range(1, 4):
+            s.update(10, time.monotonic(), frame_id=frame_id)
+            deadline = time.monotonic() + 1.
+            while controller.steering_frame != frame_id and time.monotonic() < deadline:
+                time.sleep(0.001)
+            assert controller.steering_frame == frame_id
+    finally:
+        s.stop()
+    assert registry.counters()['trace.superseded'] == 0